@@ -4,3 +4,20 @@ api_key = <value>
 feed_id = <value>
 proxy_url = <value>
 api_root_url = <value>
+page_size = <value>
+adaptive_page_size = <value>
+stream_pages = <value>
+prefetch_pages = <value>
+feed_workers = <value>
+feed_worker_mode = <value>
+kvstore_writers = <value>
+poll_interval = <value>
+max_pages_per_run = <value>
+api_rate_limit = <value>
+run_mode = <value>
+pattern_cache_size = <value>
+two_stage_pattern_parsing = <value>
+conversion_workers = <value>
+max_documents_per_batch_save = <value>
+max_size_per_batch_save_mb = <value>
+digest_index_ttl = <value>
@@ -0,0 +1,596 @@
+"""
+Asyncio clients used by the asyncio run mode of the modular input
+"""
+
+import asyncio
+import json
+import ssl
+import time
+import zlib
+from base64 import b64encode
+from collections import defaultdict
+from urllib.parse import unquote, urlencode, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+from requests.structures import CaseInsensitiveDict
+
+from sekoia_feed import (
+    CONNECT_TIMEOUT,
+    MAX_RETRIES,
+    MAX_RETRY_TIME,
+    POOL_MAXSIZE,
+    READ_TIMEOUT,
+    RETRYABLE_STATUSES,
+    FeedPage,
+    get_retry_after,
+    get_retry_delay,
+)
+from sekoia_kvstore import delete_chunks, key_query, save_chunks
+
+# Errors of a request that may succeed when retried
+RETRYABLE_ERRORS = (OSError, EOFError, asyncio.TimeoutError)
+
+# Maximum number of bytes of a body read at once
+READ_SIZE = 64 * 1024
+
+
+class AsyncHTTPError(Exception):
+    """
+    Raised for HTTP responses with an error status
+    """
+
+    def __init__(self, response):
+        super(AsyncHTTPError, self).__init__(
+            "HTTP {} {}".format(response.status_code, response.reason)
+        )
+        self.response = response
+
+
+class AsyncResponse(object):
+    """
+    Response read by the AsyncHTTPClient
+    """
+
+    def __init__(self, status_code, reason, headers, content, wire_bytes):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.wire_bytes = wire_bytes
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AsyncHTTPError(self)
+
+
+def _decompress(content, encoding):
+    encoding = (encoding or "").strip().lower()
+
+    if encoding == "gzip":
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            # raw deflate stream, without the zlib header
+            return zlib.decompress(content, -zlib.MAX_WBITS)
+
+    return content
+
+
+class AsyncHTTPClient(object):
+    """
+    Minimal HTTP/1.1 client on asyncio streams.
+
+    Keep-alive connections are pooled per (scheme, host, port) and reopened
+    when the server closed them, and gzip/deflate bodies are decompressed.
+    HTTPS requests through a proxy are tunnelled with CONNECT. Without `proxy_url`, the proxies of the
+    HTTP_PROXY, HTTPS_PROXY and NO_PROXY environment variables are used when
+    `trust_env` is set, like requests does.
+
+    The read timeout applies to each read of the response, not to the
+    whole response.
+    """
+
+    def __init__(
+        self,
+        proxy_url=None,
+        verify=True,
+        timeout=None,
+        max_idle=POOL_MAXSIZE,
+        trust_env=False,
+    ):
+        self.proxy = urlsplit(proxy_url) if proxy_url else None
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.max_idle = max_idle
+        self.trust_env = trust_env
+
+        self._ssl = ssl.create_default_context()
+        if not verify:
+            self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+
+        self._idle = defaultdict(list)
+
+        self.requests = 0
+        self.connections = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def _get_proxy(self, scheme, host):
+        """
+        Returns the proxy of the requests to the host, None without proxy
+        """
+        if self.proxy is not None or not self.trust_env:
+            return self.proxy
+
+        proxy_url = getproxies().get(scheme)
+        if not proxy_url or proxy_bypass(host):
+            return None
+
+        if "://" not in proxy_url:
+            proxy_url = "http://" + proxy_url
+
+        return urlsplit(proxy_url)
+
+    @staticmethod
+    def _proxy_authorization(proxy):
+        if not proxy.username:
+            return None
+
+        credentials = "{}:{}".format(
+            unquote(proxy.username), unquote(proxy.password or "")
+        )
+        return "Basic {}".format(b64encode(credentials.encode("utf-8")).decode("ascii"))
+
+    async def _connect(self, scheme, host, port):
+        proxy = self._get_proxy(scheme, host)
+        if proxy is None:
+            return await asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == "https" else None
+            )
+
+        reader, writer = await asyncio.open_connection(
+            proxy.hostname,
+            proxy.port or (443 if proxy.scheme == "https" else 80),
+            ssl=self._ssl if proxy.scheme == "https" else None,
+        )
+
+        if scheme == "https":
+            authority = "{}:{}".format(host, port)
+            request = "CONNECT {0} HTTP/1.1\r\nHost: {0}\r\n".format(authority)
+            authorization = self._proxy_authorization(proxy)
+            if authorization:
+                request += "Proxy-Authorization: {}\r\n".format(authorization)
+            writer.write((request + "\r\n").encode("latin-1"))
+            await writer.drain()
+
+            status_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            if b" 200 " not in status_line + b" ":
+                writer.close()
+                raise ConnectionError(
+                    "Proxy refused the tunnel: {}".format(
+                        status_line.decode("latin-1").strip()
+                    )
+                )
+
+            if hasattr(writer, "start_tls"):
+                await writer.start_tls(self._ssl, server_hostname=host)
+            else:
+                reader, writer = await self._start_tls(writer, host)
+
+        return reader, writer
+
+    async def _start_tls(self, writer, host):
+        """
+        Upgrades the connection of the writer to TLS, returns the streams of
+        the TLS transport. StreamWriter.start_tls only exists since Python
+        3.11, whose writers close their transport once unreferenced.
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        try:
+            transport = await loop.start_tls(
+                writer.transport, protocol, self._ssl, server_hostname=host
+            )
+        except BaseException:
+            writer.close()
+            raise
+
+        protocol.connection_made(transport)
+        return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+    async def _readline(self, reader):
+        return await asyncio.wait_for(reader.readline(), self.timeout[1])
+
+    async def _read(self, reader, size):
+        """
+        Reads `size` bytes, or up to the end of the stream when `size` is
+        None, each read within the read timeout
+        """
+        data = bytearray()
+
+        while size is None or len(data) < size:
+            chunk = await asyncio.wait_for(
+                reader.read(
+                    READ_SIZE if size is None else min(size - len(data), READ_SIZE)
+                ),
+                self.timeout[1],
+            )
+            if not chunk:
+                if size is None:
+                    break
+                raise asyncio.IncompleteReadError(bytes(data), size)
+
+            data += chunk
+
+        return bytes(data)
+
+    async def _read_body(self, reader, headers):
+        """
+        Reads the body of a response, returns it with whether the connection
+        can be kept alive
+        """
+        if "chunked" in headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await self._readline(reader)).split(b";")[0].strip(), 16)
+                if size == 0:
+                    # trailers
+                    while (await self._readline(reader)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks), True
+
+                chunks.append(await self._read(reader, size))
+                await self._read(reader, 2)
+
+        if "Content-Length" in headers:
+            return await self._read(reader, int(headers["Content-Length"])), True
+
+        return await self._read(reader, None), False
+
+    async def _read_response(self, reader, method):
+        status_line = await self._readline(reader)
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the server")
+
+        version, status, reason = (
+            status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""]
+        )[:3]
+        status = int(status)
+
+        headers = CaseInsensitiveDict()
+        while True:
+            line = await self._readline(reader)
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip(), value.strip()
+            headers[name] = (
+                "{}, {}".format(headers[name], value) if name in headers else value
+            )
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            raw, keep_alive = b"", True
+        else:
+            raw, keep_alive = await self._read_body(reader, headers)
+
+        keep_alive = (
+            keep_alive
+            and version == "HTTP/1.1"
+            and headers.get("Connection", "").lower() != "close"
+        )
+
+        content = _decompress(raw, headers.get("Content-Encoding"))
+        self.wire_bytes += len(raw)
+        self.decoded_bytes += len(content)
+
+        return AsyncResponse(status, reason, headers, content, len(raw)), keep_alive
+
+    async def request(self, method, url, headers=None, body=None):
+        """
+        Sends a request and reads its response
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+
+        head = {
+            "Host": parts.netloc,
+            "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        }
+        if body or method in ("POST", "PUT"):
+            head["Content-Length"] = str(len(body))
+        proxy = self._get_proxy(scheme, parts.hostname)
+        if proxy is not None and scheme == "http":
+            # plain HTTP requests are forwarded by the proxy
+            target = url
+            authorization = self._proxy_authorization(proxy)
+            if authorization:
+                head["Proxy-Authorization"] = authorization
+        head.update(headers or {})
+
+        payload = "{} {} HTTP/1.1\r\n".format(method, target)
+        payload += "".join("{}: {}\r\n".format(k, v) for k, v in head.items())
+        payload = payload.encode("latin-1") + b"\r\n" + body
+
+        while True:
+            reused = bool(self._idle[key])
+            if reused:
+                reader, writer = self._idle[key].pop()
+            else:
+                reader, writer = await asyncio.wait_for(
+                    self._connect(*key), self.timeout[0]
+                )
+                self.connections += 1
+
+            try:
+                writer.write(payload)
+                await writer.drain()
+                response, keep_alive = await self._read_response(reader, method)
+            except (ConnectionError, EOFError):
+                writer.close()
+                if reused:
+                    # the server closed the idle connection, use a new one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            self.requests += 1
+
+            if keep_alive and len(self._idle[key]) < self.max_idle:
+                self._idle[key].append((reader, writer))
+            else:
+                writer.close()
+
+            return response
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+
+        self._idle.clear()
+
+
+class AsyncFeedSession(object):
+    """
+    Asyncio counterpart of FeedSession: one pooled client per feed, carrying
+    its authorization, proxy, rate limiter and retries.
+    """
+
+    def __init__(
+        self,
+        feed_id,
+        api_key,
+        proxy_url=None,
+        rate_limiter=None,
+        max_retries=MAX_RETRIES,
+        max_retry_time=MAX_RETRY_TIME,
+    ):
+        self.feed_id = feed_id
+        self.api_key = api_key
+        self.proxy_url = proxy_url
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.max_retry_time = max_retry_time
+        self.retries = 0
+
+        self._client = AsyncHTTPClient(proxy_url=proxy_url, trust_env=True)
+        self._headers = {"Authorization": "Bearer {}".format(api_key)}
+
+    def matches(self, api_key, proxy_url, rate_limiter=None):
+        """
+        Tells whether the session was built for the given configuration
+        """
+        return (
+            self.api_key == api_key
+            and self.proxy_url == proxy_url
+            and self.rate_limiter is rate_limiter
+        )
+
+    async def _retry(self, delay):
+        self.retries += 1
+        await asyncio.sleep(delay)
+
+    async def get_page(self, url):
+        """
+        Fetches the page of indicators at `url`.
+
+        Throttled requests (honouring their Retry-After header) and
+        transient errors are retried on the same url, hence the same cursor,
+        for at most `max_retry_time` seconds.
+        """
+        deadline = time.monotonic() + self.max_retry_time
+        attempt = 0
+
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+
+            started_at = time.monotonic()
+            try:
+                response = await self._client.request("GET", url, self._headers)
+            except RETRYABLE_ERRORS:
+                delay = get_retry_delay(attempt, self.max_retries, deadline)
+                if delay is None:
+                    raise
+                await self._retry(delay)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRYABLE_STATUSES:
+                delay = get_retry_delay(
+                    attempt, self.max_retries, deadline, get_retry_after(response)
+                )
+                if delay is not None:
+                    await self._retry(delay)
+                    attempt += 1
+                    continue
+
+            response.raise_for_status()
+            data = response.json()
+
+            transfer = {
+                "wire_bytes": response.wire_bytes,
+                "decoded_bytes": len(response.content),
+                "elapsed": time.monotonic() - started_at,
+            }
+            return FeedPage(data["items"], data["next_cursor"], transfer)
+
+    def stats(self):
+        """
+        Returns the connection counters of the session
+        """
+        return {
+            "requests": self._client.requests,
+            "retries": self.retries,
+            "connections": self._client.connections,
+            "reused": max(self._client.requests - self._client.connections, 0),
+            "wire_bytes": self._client.wire_bytes,
+            "decoded_bytes": self._client.decoded_bytes,
+        }
+
+    def close(self):
+        self._client.close()
+
+
+async def write_chunks(chunks, write):
+    """
+    Runs the writes of `save_chunks` or `delete_chunks` with the `write`
+    coroutine function, returns their results. HTTP errors only fail their
+    chunk.
+    """
+    try:
+        request = next(chunks)
+        while True:
+            try:
+                outcome = await write(*request)
+            except AsyncHTTPError as error:
+                outcome = error
+            request = chunks.send(outcome)
+    except StopIteration as stop:
+        return stop.value
+
+
+class AsyncKVStoreCollectionData(object):
+    """
+    Asyncio counterpart of splunklib's KVStoreCollectionData, for the write
+    endpoints used by the modular input
+    """
+
+    JSON_HEADERS = {"Content-Type": "application/json"}
+
+    def __init__(self, collection_data, client):
+        self._data = collection_data
+        self._client = client
+
+    def _url(self, path):
+        service = self._data.service
+        return service.authority + service._abspath(
+            self._data.path + path,
+            owner=self._data.owner,
+            app=self._data.app,
+            sharing=self._data.sharing,
+        )
+
+    async def _request(self, method, path, body=None, headers=None, params=None):
+        request_headers = dict(self._data.service._auth_headers)
+        request_headers.update(headers or {})
+
+        url = self._url(path)
+        if params:
+            # appended to the str, as UrlEncoded would encode the query
+            url = str(url) + "?" + urlencode(params)
+
+        response = await self._client.request(method, url, request_headers, body)
+        response.raise_for_status()
+
+        return response
+
+    async def _batch_save(self, body, writer=None):
+        if writer is None:
+            response = await self._request(
+                "POST", "batch_save", body, self.JSON_HEADERS
+            )
+        else:
+            async with writer:
+                response = await self._request(
+                    "POST", "batch_save", body, self.JSON_HEADERS
+                )
+
+        return response.json()
+
+    async def save_records(
+        self, records, max_documents, max_bytes, writer=None, on_saved=None
+    ):
+        """
+        Inserts or updates the IOC records in chunks that fit the limits of
+        batch_save, one after the other, each one written while holding the
+        `writer` semaphore. The records of each saved chunk are passed to
+        `on_saved`, in the default executor.
+        Returns the aggregated results of the chunks.
+        """
+
+        async def save(chunk, body):
+            saved = await self._batch_save(body, writer)
+            if on_saved is not None:
+                await asyncio.get_running_loop().run_in_executor(None, on_saved, chunk)
+
+            return saved
+
+        return await write_chunks(save_chunks(records, max_documents, max_bytes), save)
+
+    async def delete_keys(self, keys, writer=None):
+        """
+        Deletes the IOCs of the keys with one query per chunk of keys, one
+        chunk after the other, each one written while holding the `writer`
+        semaphore.
+        Returns the aggregated results of the chunks.
+        """
+
+        async def delete(chunk):
+            if writer is None:
+                return await self._delete_found(chunk)
+
+            async with writer:
+                return await self._delete_found(chunk)
+
+        return await write_chunks(delete_chunks(keys), delete)
+
+    async def _delete_found(self, keys):
+        """
+        Deletes the documents found among the keys, returns their number
+        """
+        response = await self._request(
+            "GET",
+            "",
+            params={"query": key_query(keys), "fields": "_key", "limit": len(keys)},
+        )
+        found = [document["_key"] for document in response.json()]
+        if found:
+            await self._request("DELETE", "", params={"query": key_query(found)})
+
+        return len(found)
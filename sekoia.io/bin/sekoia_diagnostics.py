@@ -0,0 +1,86 @@
+"""
+Diagnostics of the conversion of the indicators to KV-Store documents
+"""
+
+from collections import defaultdict
+
+# Reasons of the indicators and comparisons skipped by the conversion
+UNSUPPORTED_PATTERN_TYPE = "unsupported pattern type"
+UNSUPPORTED_TYPE = "unsupported type"
+UNSUPPORTED_PATH = "unsupported path"
+UNSUPPORTED_OPERATOR = "unsupported operator"
+VALUE_TOO_LONG = "value longer than 1024 characters"
+INCORRECT_VALID_UNTIL = "incorrect `valid_until`"
+
+# Number of samples kept per reason
+MAX_SAMPLES = 3
+
+# Samples longer than this are cut in the summary
+MAX_SAMPLE_LENGTH = 200
+
+
+class ConversionDiagnostics(object):
+    """
+    Counts what the conversion skipped, per reason and type, with a few
+    samples per reason, to report them in one summary line rather than
+    one warning per occurrence.
+
+    The diagnostics of the chunks converted by other processes are merged
+    into the ones of the feed run.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.samples = defaultdict(list)
+
+    def __bool__(self):
+        return bool(self.counts)
+
+    def _add_sample(self, reason, sample):
+        samples = self.samples[reason]
+        if len(samples) < MAX_SAMPLES and sample not in samples:
+            samples.append(sample)
+
+    def add(self, reason, type_name, sample, count=1):
+        """
+        Counts `count` occurrences of the reason for the type
+        """
+        self.counts[(reason, type_name)] += count
+        self._add_sample(reason, sample)
+
+    def merge(self, other):
+        """
+        Adds the counters and samples of other diagnostics to these ones
+        """
+        for key, count in other.counts.items():
+            self.counts[key] += count
+
+        for reason, samples in other.samples.items():
+            for sample in samples:
+                self._add_sample(reason, sample)
+
+        return self
+
+    def summary(self):
+        """
+        Returns the counters and samples, per reason, as one line
+        """
+        types = defaultdict(list)
+        for (reason, type_name), count in sorted(self.counts.items()):
+            types[reason].append("{}: {}".format(type_name, count))
+
+        parts = []
+        for reason, type_counts in types.items():
+            total = sum(
+                count for (name, _), count in self.counts.items() if name == reason
+            )
+            samples = ", ".join(
+                repr(sample[:MAX_SAMPLE_LENGTH]) for sample in self.samples[reason]
+            )
+            parts.append(
+                "{} {} ({}; samples: {})".format(
+                    total, reason, ", ".join(type_counts), samples
+                )
+            )
+
+        return "; ".join(parts)
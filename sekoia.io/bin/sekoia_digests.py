@@ -0,0 +1,294 @@
+"""
+Index of the digests of the IOC documents saved in the KV-Stores
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from hashlib import blake2b
+
+# File of the checkpoint directory keeping the digest index
+DIGEST_INDEX_FILE = "kvstore.digests"
+
+# Default time, in seconds, during which a saved document is not saved again
+# while it is unchanged
+DEFAULT_DIGEST_INDEX_TTL = 24 * 60 * 60
+
+# Number of keys looked up per query, below the limit of SQLite variables
+MAX_KEYS_PER_LOOKUP = 500
+
+# Seconds waited for the lock of the database held by another process
+LOCK_TIMEOUT = 30
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS collections "
+    "(id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS digests "
+    "(collection INTEGER NOT NULL, key INTEGER NOT NULL, "
+    "digest INTEGER NOT NULL, indicator INTEGER NOT NULL, valid_until INTEGER, "
+    "saved_at INTEGER NOT NULL, PRIMARY KEY (collection, key)) WITHOUT ROWID",
+)
+
+
+def _hash(value):
+    """
+    Returns a signed 64 bits hash of the value, stable across processes
+    """
+    return int.from_bytes(
+        blake2b(value.encode("utf-8"), digest_size=8).digest(), "big", signed=True
+    )
+
+
+def key_hash(key):
+    """
+    Returns the hash of the `_key` of a document
+    """
+    return _hash(str(key))
+
+
+def indicator_hash(record):
+    """
+    Returns the hash of the indicator of an IOC record
+    """
+    return _hash(str(record.indicator_id))
+
+
+def record_digest(record):
+    """
+    Returns the digest of the fields of an IOC record
+    """
+    return _hash(
+        repr((record.indicator_id, record.server_root_url, record.valid_until))
+    )
+
+
+class DigestIndex(object):
+    """
+    Keeps, per KV-Store collection and `_key`, a digest of the last saved
+    document, its indicator, its `valid_until` and when it was saved, in a
+    SQLite database of the checkpoint directory, so that the unchanged IOCs
+    aren't saved again, nor the IOCs of another indicator expiring before
+    the saved one.
+
+    The keys, digests and indicators are stored as 64 bits hashes. An entry
+    is trusted during `ttl` seconds after its save: documents deleted from
+    the KV-Stores by someone else are saved again at the latest after that.
+    The database is shared by the threads and processes of the modular
+    input. An error of the database never fails a save: the documents are
+    then considered changed.
+    """
+
+    def __init__(self, checkpoint_dir, ttl=DEFAULT_DIGEST_INDEX_TTL):
+        self.path = os.path.join(checkpoint_dir, DIGEST_INDEX_FILE)
+        self.ttl = ttl
+        self.unchanged = 0
+        self.superseded = 0
+        self.changed = 0
+        self.errors = 0
+
+        self._connection = None
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._pruned_at = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=LOCK_TIMEOUT, check_same_thread=False
+            )
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                with connection:
+                    for statement in _SCHEMA:
+                        connection.execute(statement)
+            except BaseException:
+                connection.close()
+                raise
+
+            self._connection = connection
+
+        return self._connection
+
+    def _failed(self):
+        with self._lock:
+            self.errors += 1
+
+    def _collection_id(self, name):
+        if name not in self._collections:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO collections (name) VALUES (?)", (name,)
+                )
+            (self._collections[name],) = connection.execute(
+                "SELECT id FROM collections WHERE name = ?", (name,)
+            ).fetchone()
+
+        return self._collections[name]
+
+    def filter_changed(self, collection, records):
+        """
+        Returns the records that are new or changed since they were saved
+        in the collection, or whose save is older than the ttl. The records
+        of another indicator than the saved one are kept only when they
+        don't expire before it.
+        """
+        saved = {}
+        since = int(time.time()) - self.ttl
+        records = [(record, key_hash(record.key)) for record in records]
+
+        try:
+            with self._lock:
+                connection = self._connect()
+                collection_id = self._collection_id(collection)
+                hashes = list({key for _, key in records})
+
+                for start in range(0, len(hashes), MAX_KEYS_PER_LOOKUP):
+                    chunk = hashes[start : start + MAX_KEYS_PER_LOOKUP]
+                    saved.update(
+                        (key, entry)
+                        for key, *entry in connection.execute(
+                            "SELECT key, digest, indicator, valid_until FROM digests "
+                            "WHERE collection = ? AND saved_at > ? "
+                            "AND key IN ({})".format(",".join("?" * len(chunk))),
+                            [collection_id, since] + chunk,
+                        )
+                    )
+        except sqlite3.Error:
+            self._failed()
+            saved = {}
+
+        changed = []
+        unchanged = superseded = 0
+
+        for record, key in records:
+            entry = saved.get(key)
+            if entry is None:
+                changed.append(record)
+                continue
+
+            digest, indicator, valid_until = entry
+            if digest == record_digest(record):
+                unchanged += 1
+            elif (
+                indicator != indicator_hash(record)
+                and isinstance(valid_until, int)
+                and isinstance(record.valid_until, int)
+                and valid_until > record.valid_until
+            ):
+                superseded += 1
+            else:
+                changed.append(record)
+
+        with self._lock:
+            self.unchanged += unchanged
+            self.superseded += superseded
+            self.changed += len(changed)
+
+        return changed
+
+    def update(self, collection, records):
+        """
+        Records the digests of the records saved in the collection
+        """
+        now = int(time.time())
+        rows = [
+            (
+                key_hash(record.key),
+                record_digest(record),
+                indicator_hash(record),
+                record.valid_until if isinstance(record.valid_until, int) else None,
+            )
+            for record in records
+        ]
+
+        try:
+            with self._lock:
+                connection = self._connect()
+                collection_id = self._collection_id(collection)
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO digests (collection, key, digest, "
+                        "indicator, valid_until, saved_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(collection_id,) + row + (now,) for row in rows],
+                    )
+        except sqlite3.Error:
+            self._failed()
+
+    def discard(self, collection, keys):
+        """
+        Forgets the documents of the keys, e.g. before they are deleted
+        """
+        hashes = [key_hash(key) for key in keys]
+
+        try:
+            with self._lock:
+                connection = self._connect()
+                collection_id = self._collection_id(collection)
+                with connection:
+                    connection.executemany(
+                        "DELETE FROM digests WHERE collection = ? AND key = ?",
+                        [(collection_id, key) for key in hashes],
+                    )
+        except sqlite3.Error:
+            self._failed()
+
+    def clear(self, collection):
+        """
+        Forgets all the documents of the collection, e.g. when it is created
+        """
+        try:
+            with self._lock:
+                connection = self._connect()
+                collection_id = self._collection_id(collection)
+                with connection:
+                    connection.execute(
+                        "DELETE FROM digests WHERE collection = ?", (collection_id,)
+                    )
+        except sqlite3.Error:
+            self._failed()
+
+    def prune(self):
+        """
+        Removes the entries older than the ttl, at most once per ttl,
+        returns whether they were removed
+        """
+        now = int(time.time())
+        if self._pruned_at is not None and now - self._pruned_at < self.ttl:
+            return False
+
+        try:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "DELETE FROM digests WHERE saved_at <= ?", (now - self.ttl,)
+                    )
+        except sqlite3.Error:
+            self._failed()
+            return False
+
+        self._pruned_at = now
+        return True
+
+    def stats(self):
+        """
+        Returns the numbers of unchanged, superseded and changed records and
+        of errors
+        """
+        with self._lock:
+            return {
+                "unchanged": self.unchanged,
+                "superseded": self.superseded,
+                "changed": self.changed,
+                "errors": self.errors,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+                self._collections = {}
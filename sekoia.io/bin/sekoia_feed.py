@@ -0,0 +1,708 @@
+"""
+HTTP helpers used to page through SEKOIA.IO Intelligence Center feeds
+"""
+
+import asyncio
+import codecs
+import json
+import queue
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts, in seconds, applied to every feed request
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# Number of keep-alive connections kept per host
+POOL_MAXSIZE = 4
+
+# Number of indicators requested per page, and the bounds accepted by the API
+DEFAULT_PAGE_SIZE = 300
+MIN_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Adaptive page sizing aims at pages fetched within this delay (in seconds)
+# and no larger than this size once decompressed (in bytes)
+TARGET_PAGE_LATENCY = 5.0
+MAX_PAGE_BYTES = 16 * 1024 * 1024
+
+# Size of the chunks read from the (decompressed) response stream
+CHUNK_SIZE = 64 * 1024
+
+# Retries of the requests throttled by the API or failing on transient errors
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+MAX_RETRY_DELAY = 300.0
+# Time, in seconds, a request may spend waiting for its retries
+MAX_RETRY_TIME = 600.0
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# Requests per second allowed by default towards one API root
+DEFAULT_API_RATE_LIMIT = 10
+
+
+class RateLimiter(object):
+    """
+    Thread-safe token bucket bounding the rate of the requests sent to an API.
+
+    Built with a multiprocessing `context`, its tokens are kept in shared
+    memory and the bucket is shared by the processes it is passed to when
+    they are started.
+    """
+
+    def __init__(self, rate, burst=None, context=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+
+        # tokens, and when they were last updated
+        if context is None:
+            self._state = [self.capacity, time.monotonic()]
+            self._lock = threading.Lock()
+        else:
+            self._state = context.Array(
+                "d", [self.capacity, time.monotonic()], lock=False
+            )
+            self._lock = context.Lock()
+
+    def _reserve(self):
+        """
+        Takes a token, or returns the delay before one is available
+        """
+        with self._lock:
+            tokens, updated_at = self._state[0], self._state[1]
+            now = time.monotonic()
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+            if tokens >= 1:
+                self._state[0], self._state[1] = tokens - 1, now
+                return 0
+
+            self._state[0], self._state[1] = tokens, now
+            return (1 - tokens) / self.rate
+
+    def acquire(self):
+        """
+        Waits until a request can be sent
+        """
+        while True:
+            delay = self._reserve()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """
+        Waits, without blocking the event loop, until a request can be sent
+        """
+        while True:
+            delay = self._reserve()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_root_url, rate=DEFAULT_API_RATE_LIMIT):
+    """
+    Returns the rate limiter shared by all the feeds of the same API root,
+    None when `rate` doesn't limit the requests
+    """
+    if not rate or rate <= 0:
+        return None
+
+    key = api_root_url.rstrip("/")
+
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None or limiter.rate != rate:
+            limiter = RateLimiter(rate)
+            _rate_limiters[key] = limiter
+
+        return limiter
+
+
+def get_shared_rate_limiters(api_root_urls, rate, context):
+    """
+    Returns the rate limiters of the API roots, by API root, to be shared by
+    the processes of the multiprocessing context with `use_rate_limiters`
+    """
+    if not rate or rate <= 0:
+        return {}
+
+    return {
+        api_root_url.rstrip("/"): RateLimiter(rate, context=context)
+        for api_root_url in set(api_root_urls)
+    }
+
+
+def use_rate_limiters(rate_limiters):
+    """
+    Makes get_rate_limiter return the given rate limiters of the API roots,
+    e.g. the ones shared by the parent process
+    """
+    with _rate_limiters_lock:
+        _rate_limiters.update(rate_limiters)
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff, with full jitter, before the retry `attempt`
+    """
+    return random.uniform(0, min(RETRY_BASE_DELAY * 2**attempt, MAX_RETRY_DELAY))
+
+
+def get_retry_delay(attempt, max_retries, deadline, delay=None):
+    """
+    Returns the delay before the retry `attempt`: `delay` when the API
+    requested it, the backoff one otherwise. None when the request is out
+    of retries or would be retried after the monotonic `deadline`.
+    """
+    if attempt >= max_retries:
+        return None
+
+    if delay is None:
+        delay = backoff_delay(attempt)
+    delay = min(delay, MAX_RETRY_DELAY)
+
+    if time.monotonic() + delay > deadline:
+        return None
+
+    return delay
+
+
+def get_retry_after(response):
+    """
+    Reads the delay, in seconds, requested by the Retry-After header
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class FeedSession(object):
+    """
+    Long-lived, connection-pooled HTTP session bound to one feed.
+
+    The session carries the authorization header, the proxy settings and
+    the timeouts of the feed so that every page (and every cycle) reuses
+    the same keep-alive connections instead of paying a new TCP+TLS
+    handshake (and proxy CONNECT) per request.
+    """
+
+    def __init__(
+        self,
+        feed_id,
+        api_key,
+        proxy_url=None,
+        timeout=None,
+        rate_limiter=None,
+        max_retries=MAX_RETRIES,
+        max_retry_time=MAX_RETRY_TIME,
+    ):
+        self.feed_id = feed_id
+        self.api_key = api_key
+        self.proxy_url = proxy_url
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.max_retry_time = max_retry_time
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._session.headers["Authorization"] = "Bearer {}".format(api_key)
+        # Pages of STIX indicators are repetitive JSON documents that compress well
+        self._session.headers["Accept-Encoding"] = "gzip, deflate"
+
+        # given on each request: the proxies of the session are overridden by
+        # the HTTP(S)_PROXY environment variables
+        self._proxies = None
+        if proxy_url:
+            self._proxies = {"http": proxy_url, "https": proxy_url}
+
+        self.requests = 0
+        self.retries = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def matches(self, api_key, proxy_url, rate_limiter=None):
+        """
+        Tells whether the session was built for the given configuration
+        """
+        return (
+            self.api_key == api_key
+            and self.proxy_url == proxy_url
+            and self.rate_limiter is rate_limiter
+        )
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("proxies", self._proxies)
+        response = self._session.get(url, **kwargs)
+        self.requests += 1
+        return response
+
+    def _retry(self, delay):
+        self.retries += 1
+        time.sleep(delay)
+
+    def _open(self, url, deadline=None):
+        """
+        Sends a GET request on `url` and returns its streamed body.
+
+        Throttled requests (honouring their Retry-After header) and
+        transient errors are retried on the same url, hence the same cursor,
+        for at most `max_retry_time` seconds or until `deadline`.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.max_retry_time
+        attempt = 0
+
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            started_at = time.monotonic()
+            try:
+                response = self.get(url, stream=True)
+            except RETRYABLE_ERRORS:
+                delay = get_retry_delay(attempt, self.max_retries, deadline)
+                if delay is None:
+                    raise
+                self._retry(delay)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRYABLE_STATUSES:
+                delay = get_retry_delay(
+                    attempt, self.max_retries, deadline, get_retry_after(response)
+                )
+                if delay is not None:
+                    response.close()
+                    self._retry(delay)
+                    attempt += 1
+                    continue
+
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+
+            return _ResponseBody(self, response, time.monotonic() - started_at)
+
+    def get_page(self, url):
+        """
+        Fetches the page of indicators at `url`.
+
+        The body is decompressed on the fly while it is streamed from the
+        connection, then decoded at once.
+        """
+        deadline = time.monotonic() + self.max_retry_time
+        attempt = 0
+
+        while True:
+            body = self._open(url, deadline)
+
+            try:
+                data = json.loads(b"".join(body.chunks()))
+            except RETRYABLE_ERRORS:
+                delay = get_retry_delay(attempt, self.max_retries, deadline)
+                if delay is None:
+                    raise
+                self._retry(delay)
+                attempt += 1
+                continue
+
+            return FeedPage(data["items"], data["next_cursor"], body.transfer())
+
+    def stream_page(self, url):
+        """
+        Fetches the page of indicators at `url`, decoding its indicators one
+        at a time while the body is read from the connection
+        """
+        return StreamedFeedPage(self._open(url))
+
+    def _pools(self):
+        managers = [self._adapter.poolmanager]
+        managers.extend(self._adapter.proxy_manager.values())
+
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def stats(self):
+        """
+        Returns the connection counters of the session
+        """
+        connections = 0
+        pooled_requests = 0
+        for pool in self._pools():
+            connections += pool.num_connections
+            pooled_requests += pool.num_requests
+
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "connections": connections,
+            "reused": max(pooled_requests - connections, 0),
+            "wire_bytes": self.wire_bytes,
+            "decoded_bytes": self.decoded_bytes,
+        }
+
+    def close(self):
+        self._session.close()
+
+
+class _ResponseBody(object):
+    """
+    Decompressed body of a streamed response, with its transfer counters
+    """
+
+    def __init__(self, session, response, elapsed):
+        self._session = session
+        self._response = response
+        self._closed = False
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.elapsed = elapsed
+
+    def chunks(self):
+        """
+        Yields the decompressed chunks of the body.
+
+        Only the time spent reading from the connection is accounted,
+        not the time the consumer spends between two chunks.
+        """
+        try:
+            iterator = self._response.iter_content(CHUNK_SIZE)
+            while True:
+                started_at = time.monotonic()
+                chunk = next(iterator, None)
+                self.elapsed += time.monotonic() - started_at
+
+                if chunk is None:
+                    break
+
+                self.decoded_bytes += len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        # bytes pulled from the socket, before decompression
+        self.wire_bytes = self._response.raw.tell() or self.decoded_bytes
+        self._response.close()
+
+        self._session.wire_bytes += self.wire_bytes
+        self._session.decoded_bytes += self.decoded_bytes
+
+    def transfer(self):
+        return {
+            "wire_bytes": self.wire_bytes,
+            "decoded_bytes": self.decoded_bytes,
+            "elapsed": self.elapsed,
+        }
+
+
+class FeedPage(object):
+    """
+    A page of indicators fetched from a feed
+    """
+
+    def __init__(self, items, next_cursor, transfer):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.transfer = transfer
+        self.size = len(items)
+
+    @property
+    def last(self):
+        """
+        Whether the feed ends with this page: it is empty or has no cursor.
+        A page shorter than the requested one may not be the last.
+        """
+        return not self.next_cursor or not self.size
+
+    def finish(self):
+        """
+        Reads what remains of the page
+        """
+
+    def close(self):
+        """
+        Releases the connection of the page
+        """
+
+
+class StreamedFeedPage(FeedPage):
+    """
+    A page of indicators decoded while it is read from the connection.
+
+    `items` can only be iterated once. `size`, `next_cursor` and `transfer`
+    are known once every indicator of the page has been read.
+    """
+
+    def __init__(self, body):
+        self._body = body
+        self._stream = JSONItemsStream(body.chunks(), key="items")
+        super(StreamedFeedPage, self).__init__([], None, None)
+        self.items = self._iter_items()
+
+    def _iter_items(self):
+        try:
+            for item in self._stream:
+                self.size += 1
+                yield item
+        finally:
+            self._body.close()
+
+        self.next_cursor = self._stream.envelope.get("next_cursor")
+        self.transfer = self._body.transfer()
+
+    def finish(self):
+        for _ in self.items:
+            pass
+
+    def close(self):
+        self.items.close()
+
+
+class JSONItemsStream(object):
+    """
+    Incremental decoder of a JSON object read from a stream of byte chunks.
+
+    Iterating over the decoder yields the elements of the `key` array one at
+    a time, as soon as they are complete, so that only one element (and one
+    chunk) is held in memory at once. The other members of the object are
+    collected in `envelope`.
+    """
+
+    _WHITESPACE = re.compile(r"[ \t\n\r]*")
+    _DELIMITERS = frozenset(" \t\n\r,:]}")
+
+    def __init__(self, chunks, key="items"):
+        self.key = key
+        self.envelope = {}
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+
+    def _read(self):
+        """
+        Appends the next chunk to the buffer,
+        returns False once the stream is exhausted
+        """
+        if self._eof:
+            return False
+
+        # drop the text already decoded
+        self._buffer = self._buffer[self._position :]
+        self._position = 0
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._buffer += self._text.decode(b"", final=True)
+            self._eof = True
+            return False
+
+        self._buffer += self._text.decode(chunk)
+        return True
+
+    def _peek(self):
+        """
+        Skips whitespaces and returns the next character, None at the end
+        """
+        while True:
+            self._position = self._WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return None
+
+    def _expect(self, expected):
+        char = self._peek()
+        if char is None or char not in expected:
+            raise ValueError(
+                "Expected one of {!r} but got {!r} in JSON stream".format(
+                    expected, char
+                )
+            )
+
+        self._position += 1
+        return char
+
+    def _value(self):
+        self._peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+                # a value not followed by a delimiter may be truncated (e.g. a number)
+                if self._eof or self._buffer[end : end + 1] in self._DELIMITERS:
+                    self._position = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._read()
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._position += 1
+            return
+
+        while True:
+            key = self._value()
+            self._expect(":")
+
+            if key == self.key:
+                self._expect("[")
+                if self._peek() == "]":
+                    self._position += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.envelope[key] = self._value()
+
+            if self._expect(",}") == "}":
+                break
+
+
+class PageSizer(object):
+    """
+    Chooses the number of indicators requested per page.
+
+    With a fixed page size the configured value is always used. In adaptive
+    mode the page size is halved when a page is slow, too large or fails, and
+    grown by half when full pages come back quickly, always staying within
+    the bounds accepted by the API.
+    """
+
+    def __init__(
+        self,
+        page_size=DEFAULT_PAGE_SIZE,
+        adaptive=False,
+        target_latency=TARGET_PAGE_LATENCY,
+        max_page_bytes=MAX_PAGE_BYTES,
+    ):
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.max_page_bytes = max_page_bytes
+        self.page_size = self._bound(page_size)
+
+    @staticmethod
+    def _bound(page_size):
+        return max(MIN_PAGE_SIZE, min(MAX_PAGE_SIZE, int(page_size)))
+
+    def record_page(self, items, transfer):
+        """
+        Adapts the page size to the page that was just fetched
+        """
+        if not self.adaptive:
+            return
+
+        if (
+            transfer["elapsed"] > self.target_latency
+            or transfer["decoded_bytes"] > self.max_page_bytes
+        ):
+            self.page_size = self._bound(self.page_size // 2)
+        elif items >= self.page_size and transfer["elapsed"] < self.target_latency / 2:
+            self.page_size = self._bound(self.page_size + self.page_size // 2)
+
+    def record_error(self):
+        """
+        Shrinks the page size after a failed request
+        """
+        if self.adaptive:
+            self.page_size = self._bound(self.page_size // 2)
+
+
+_END_OF_PAGES = object()
+
+
+def prefetch_pages(pages, depth=1):
+    """
+    Iterates over `pages` from a background fetcher thread.
+
+    Up to `depth` pages are fetched ahead and buffered in a bounded queue,
+    so that the network round-trip of page N+1 overlaps the conversion and
+    the storage of page N. Errors raised by the fetcher are re-raised to the
+    consumer once the pages fetched before the failure have been consumed.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch():
+        try:
+            for page in pages:
+                if not put((page, None)):
+                    return
+        except Exception as error:
+            put((None, error))
+            return
+        put((_END_OF_PAGES, None))
+
+    fetcher = threading.Thread(target=fetch, name="sekoia-prefetch")
+    fetcher.daemon = True
+    fetcher.start()
+
+    try:
+        while True:
+            page, error = buffer.get()
+            if error is not None:
+                raise error
+            if page is _END_OF_PAGES:
+                break
+            yield page
+    finally:
+        stopped.set()
+        fetcher.join()
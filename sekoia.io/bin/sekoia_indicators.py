@@ -1,12 +1,21 @@
 from __future__ import print_function
 
+import asyncio
+import multiprocessing
 import os
+import re
 import sys
+import threading
 import time
 import traceback
 from collections import defaultdict
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
+from itertools import islice
 from posixpath import join as urljoin
+from urllib.parse import urlsplit
 
 if sys.version_info[0] < 3:
     py_version = "py2"
@@ -19,28 +28,297 @@ import requests  # noqa: E402
 import six  # noqa: E402
 import splunklib.client as client  # noqa: E402
 from splunklib.binding import HTTPError  # noqa: E402
-from splunklib.modularinput import Argument, Scheme, Script  # noqa: E402
-from stix2patterns.pattern import Pattern  # noqa: E402
+from splunklib.modularinput import Argument, EventWriter, Scheme, Script  # noqa: E402
+
+from sekoia_async import (  # noqa: E402
+    AsyncFeedSession,
+    AsyncHTTPClient,
+    AsyncKVStoreCollectionData,
+)
+from sekoia_diagnostics import (  # noqa: E402
+    INCORRECT_VALID_UNTIL,
+    UNSUPPORTED_OPERATOR,
+    UNSUPPORTED_PATH,
+    UNSUPPORTED_PATTERN_TYPE,
+    UNSUPPORTED_TYPE,
+    VALUE_TOO_LONG,
+    ConversionDiagnostics,
+)
+from sekoia_digests import DEFAULT_DIGEST_INDEX_TTL, DigestIndex  # noqa: E402
+from sekoia_feed import (  # noqa: E402
+    DEFAULT_API_RATE_LIMIT,
+    DEFAULT_PAGE_SIZE,
+    FeedSession,
+    PageSizer,
+    get_rate_limiter,
+    get_shared_rate_limiters,
+    prefetch_pages,
+    use_rate_limiters,
+)
+from sekoia_kvstore import (  # noqa: E402
+    IOCCollectionData,
+    IOCRecord,
+    get_batch_save_limits,
+    latest_records,
+)
+from sekoia_patterns import (  # noqa: E402
+    PATTERN_COUNTERS,
+    DFACache,
+    PatternExtractor,
+    merge_pattern_stats,
+    new_pattern_stats,
+)
+from sekoia_scheduler import DEFAULT_POLL_INTERVAL, FeedScheduler  # noqa: E402
+from sekoia_splunkd import PooledHandler  # noqa: E402
 
 SEKOIAIO_REALM = "sekoiaio_realm"
 MASK = "<nothing to see here>"
 DEFAULT_FEED = "d6092c37-d8d7-45c3-8aff-c4dc26030608"
 BASE_URL = "https://api.sekoia.io"
-LIMIT = 300
+DEFAULT_PREFETCH_PAGES = 1
+DEFAULT_MAX_PAGES_PER_RUN = 100
+DEFAULT_FEED_WORKERS = 1
+DEFAULT_PATTERN_CACHE_SIZE = 32
+MIN_CONVERSION_CHUNK = 50
+STREAM_BATCH_SIZE = 200
+INDICATOR_FIELDS = ("id", "pattern", "pattern_type", "valid_until", "revoked")
+FEED_WORKER_MODES = ("thread", "process")
+RUN_MODES = ("sync", "asyncio")
+INT_ARGUMENTS = (
+    "page_size",
+    "feed_workers",
+    "api_rate_limit",
+    "conversion_workers",
+    "pattern_cache_size",
+    "kvstore_writers",
+    "max_documents_per_batch_save",
+    "max_size_per_batch_save_mb",
+    "digest_index_ttl",
+    "poll_interval",
+    "max_pages_per_run",
+    "prefetch_pages",
+)
+CHOICE_ARGUMENTS = {"run_mode": RUN_MODES, "feed_worker_mode": FEED_WORKER_MODES}
 COLLECTION_NAME = "sekoia_iocs_{}"
+TIMESTAMP_CACHE_SIZE = 4096
+RFC3339_DATE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[Tt](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?"
+    r"(?:[Zz]|([+-])(\d{2}):(\d{2}))\Z"
+)
+EPOCH = datetime(1970, 1, 1)
 SUPPORTED_TYPES = {
     "ipv4-addr": {"value": "ipv4"},
     "domain-name": {"value": "domain"},
     "url": {"value": "url"},
     "file": {"hashes.MD5": "md5", "hashes.SHA-1": "sha1", "hashes.SHA-256": "sha256"},
 }
+IOC_TYPES = sorted(
+    ioc_type for paths in SUPPORTED_TYPES.values() for ioc_type in paths.values()
+)
 
 
-def from_rfc3339(date_string):
+def get_int_argument(input_item, name, default):
+    """
+    Reads an optional integer argument of the modular input,
+    `default` when it is not an integer
+    """
+    value = input_item.get(name)
+
+    if value is None or str(value).strip() == "":
+        return default
+
     try:
-        return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%S.%fZ")
+        return int(value)
     except ValueError:
-        return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%SZ")
+        return default
+
+
+def get_choice_argument(input_item, name, choices):
+    """
+    Reads an optional argument of the modular input among `choices`,
+    the first choice when it is not set or not one of them
+    """
+    value = str(input_item.get(name) or "").strip().lower()
+
+    return value if value in choices else choices[0]
+
+
+def get_argument_errors(input_item):
+    """
+    Returns the errors of the integer and choice arguments of the modular input
+    """
+    errors = []
+
+    for name in INT_ARGUMENTS:
+        value = input_item.get(name)
+        if value is None or str(value).strip() == "":
+            continue
+        try:
+            int(value)
+        except ValueError:
+            errors.append(f"{name} must be an integer, not '{value}'")
+
+    for name, choices in six.iteritems(CHOICE_ARGUMENTS):
+        value = str(input_item.get(name) or "").strip().lower()
+        if value and value not in choices:
+            errors.append(
+                f"{name} must be one of {', '.join(choices)}, "
+                f"not '{input_item.get(name)}'"
+            )
+
+    return errors
+
+
+def get_bool_argument(input_item, name, default):
+    """
+    Reads an optional boolean argument of the modular input
+    """
+    value = input_item.get(name)
+
+    if value is None or str(value).strip() == "":
+        return default
+
+    return str(value).strip().lower() in ("1", "true", "t", "yes", "y")
+
+
+def get_page_url(feed_url, page_size, cursor=None):
+    """
+    Returns the url of the page of the feed starting at `cursor`
+    """
+    url = "{}&limit={}".format(feed_url, page_size)
+    if cursor:
+        url = "{}&cursor={}".format(url, cursor)
+
+    return url
+
+
+def get_feed_id(input_item):
+    """
+    Reads the feed of the modular input
+    """
+    return input_item.get("feed_id", "") or DEFAULT_FEED
+
+
+def get_poll_interval(input_item):
+    """
+    Reads the poll interval of the modular input, in seconds
+    """
+    return get_int_argument(input_item, "poll_interval", DEFAULT_POLL_INTERVAL)
+
+
+def get_pattern_cache_size(inputs):
+    """
+    Reads the memory budget of the cache of the patterns, in bytes
+    """
+    cache_size = get_int_argument(
+        get_shared_arguments(inputs), "pattern_cache_size", DEFAULT_PATTERN_CACHE_SIZE
+    )
+
+    return cache_size * 1024 * 1024
+
+
+def get_two_stage_parsing(inputs):
+    """
+    Reads whether the STIX patterns are parsed with the two-stage prediction
+    """
+    return get_bool_argument(
+        get_shared_arguments(inputs), "two_stage_pattern_parsing", False
+    )
+
+
+def get_indicator_rows(indicators):
+    """
+    Returns the fields of the indicators read by the conversion, as tuples
+    """
+    return [
+        (
+            indicator.get("id"),
+            indicator.get("pattern"),
+            indicator.get("pattern_type"),
+            indicator.get("valid_until"),
+            indicator.get("revoked", False),
+        )
+        for indicator in indicators
+    ]
+
+
+def merge_conversions(conversions):
+    """
+    Merges the KV documents, the diagnostics and the pattern stats of chunks
+    of indicators converted by the conversion processes, in order
+    """
+    objects = defaultdict(list)
+    revoked = defaultdict(list)
+    diagnostics = ConversionDiagnostics()
+    pattern_stats = new_pattern_stats()
+
+    for chunk_objects, chunk_revoked, chunk_diagnostics, chunk_stats in conversions:
+        for ioc_type, dicts in six.iteritems(chunk_objects):
+            objects[ioc_type] += dicts
+        for ioc_type, dicts in six.iteritems(chunk_revoked):
+            revoked[ioc_type] += dicts
+        diagnostics.merge(chunk_diagnostics)
+        merge_pattern_stats(pattern_stats, chunk_stats)
+
+    return objects, revoked, diagnostics, pattern_stats
+
+
+def get_shared_arguments(inputs):
+    """
+    Merges the arguments of all the inputs, for the settings shared by the
+    single instance of the modular input.
+    The first input, by name, that sets an argument wins.
+    """
+    shared = {}
+
+    for input_name in sorted(inputs.inputs, reverse=True):
+        for name, value in six.iteritems(inputs.inputs[input_name]):
+            if value is not None and str(value).strip() != "":
+                shared[name] = value
+
+    return shared
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def rfc3339_to_timestamp(date_string):
+    """
+    Returns the UTC epoch of a RFC 3339 date, None if invalid.
+
+    Each distinct date is parsed once: the latest ones are cached.
+    """
+    match = RFC3339_DATE.match(date_string)
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second = map(int, match.group(1, 2, 3, 4, 5, 6))
+    try:
+        date = datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return None
+
+    timestamp = (date - EPOCH) // timedelta(seconds=1)
+
+    sign, offset_hours, offset_minutes = match.group(7, 8, 9)
+    if sign:
+        offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+        timestamp += -offset if sign == "+" else offset
+
+    return timestamp
+
+
+def get_server_root_url(api_root_url):
+    """
+    Returns the url of the SEKOIA.IO app serving the API
+    """
+    if not api_root_url:
+        return "https://app.sekoia.io"
+
+    if api_root_url.endswith("/api"):
+        return api_root_url[:-4]
+    elif api_root_url.endswith("/api/"):
+        return api_root_url[:-5]
+
+    return api_root_url
 
 
 class SEKOIAIndicators(Script):
@@ -48,6 +326,59 @@ class SEKOIAIndicators(Script):
         super(SEKOIAIndicators, self).__init__(*args, **kwargs)
         self._splunk = None
         self._kv_stores = {}
+        self._feed_sessions = {}
+        self._page_sizers = {}
+        self._kv_stores_lock = threading.Lock()
+        self._kv_writers = None
+        self._feed_executor = None
+        self._feed_executor_configuration = None
+        self._scheduler = None
+        self._dfa_cache = None
+        self._conversion_executor = None
+        self._conversion_executor_configuration = None
+        self._patterns = PatternExtractor(
+            SUPPORTED_TYPES, DEFAULT_PATTERN_CACHE_SIZE * 1024 * 1024
+        )
+        self._loop = None
+        self._async_feed_sessions = {}
+        self._async_kv_writers = None
+        self._splunkd_client = None
+        self._batch_save_limits = None
+        self._kv_write_executor = None
+        self._kv_write_threads = None
+        self._splunkd_handler = None
+        self._splunkd_batch_save_limits = None
+        self._digests = None
+
+    def get_splunkd_handler(self):
+        """
+        Returns the request handler keeping the connections to splunkd alive,
+        shared by the Splunk services of the modular input
+        """
+        if self._splunkd_handler is None:
+            self._splunkd_handler = PooledHandler()
+
+        return self._splunkd_handler
+
+    @property
+    def service(self):
+        """
+        Returns the Splunk service of the script invocation, sending its
+        requests through the pooled handler
+        """
+        if self._service is None and self._input_definition is not None:
+            splunkd = urlsplit(
+                self._input_definition.metadata["server_uri"], allow_fragments=False
+            )
+            self._service = client.Service(
+                scheme=splunkd.scheme,
+                host=splunkd.hostname,
+                port=splunkd.port,
+                token=self._input_definition.metadata["session_key"],
+                handler=self.get_splunkd_handler(),
+            )
+
+        return self._service
 
     # Get current feed cursor (splunk checkpoint)
     def get_cursor(self, inputs, feed_id):
@@ -116,120 +447,156 @@ class SEKOIAIndicators(Script):
         item.update(**kwargs).refresh()
         ew.log(ew.INFO, "Input succesfully updated")
 
-    def get_indicators(
-        self, feed_id, api_key, api_root_url=None, proxy_url=None, cursor=None, ew=None
+    def get_feed_session(
+        self, feed_id, api_key, proxy_url=None, api_root_url=None, rate_limit=None
     ):
         """
-        Fetch and yelds indicators from the configuration feed
+        Returns the pooled HTTP session of the feed, kept across the cycles.
+
+        Its requests are rate limited with the feeds sharing the same API root.
         """
+        rate_limiter = get_rate_limiter(api_root_url or BASE_URL, rate_limit)
+        session = self._feed_sessions.get(feed_id)
 
-        if ew:
-            ew.log(
-                ew.INFO,
-                f"Fetch indicators from feed_id={feed_id} (api_root_url={api_root_url})",
+        if session is None or not session.matches(api_key, proxy_url, rate_limiter):
+            if session is not None:
+                session.close()
+
+            session = FeedSession(
+                feed_id, api_key, proxy_url=proxy_url, rate_limiter=rate_limiter
             )
+            self._feed_sessions[feed_id] = session
 
-        proxies = None
+        return session
 
-        if proxy_url:
-            proxies = {"http": proxy_url, "https": proxy_url}
-            if ew:
-                ew.log(
-                    ew.DEBUG, f"Configure network proxy access with proxy={proxy_url}"
-                )
+    def get_page_sizer(self, feed_id, page_size, adaptive):
+        """
+        Returns the page sizer of the feed, kept across the cycles
+        """
+        configuration, sizer = self._page_sizers.get(feed_id, (None, None))
+
+        if configuration != (page_size, adaptive):
+            sizer = PageSizer(page_size, adaptive=adaptive)
+            self._page_sizers[feed_id] = ((page_size, adaptive), sizer)
 
+        return sizer
+
+    def get_feed_url(self, feed_id, api_root_url=None):
+        """
+        Returns the url of the indicators of the feed
+        """
         url_root = BASE_URL
         if api_root_url:
             url_root = api_root_url
 
-        url = urljoin(
-            url_root+"/",
+        return urljoin(
+            url_root + "/",
             "v2/inthreat/collections",
             feed_id,
-            "objects?match[type]=indicator&limit={}".format(LIMIT),
+            "objects?match[type]=indicator",
         )
-        paginated_url = url
 
-        while True:
-            if cursor:
-                paginated_url = "{}&cursor={}".format(url, cursor)
+    def get_indicators(
+        self,
+        feed_id,
+        api_key,
+        api_root_url=None,
+        proxy_url=None,
+        cursor=None,
+        ew=None,
+        session=None,
+        page_sizer=None,
+        streaming=False,
+        max_pages=0,
+    ):
+        """
+        Fetch and yelds the pages of indicators from the configuration feed
+
+        With `streaming`, the indicators of each page are decoded one at a
+        time while they are read, and the cursor of the page is only known
+        once all of them have been consumed. At most `max_pages` pages are
+        fetched when set.
+        """
 
-            response = requests.get(
-                paginated_url,
-                headers={"Authorization": "Bearer {}".format(api_key)},
-                proxies=proxies,
+        if ew:
+            ew.log(
+                ew.INFO,
+                f"Fetch indicators from feed_id={feed_id} (api_root_url={api_root_url})",
             )
-            if ew:
-                ew.log(
-                    ew.DEBUG,
-                    "API call on {url} returned an HTTP status-code={response.status_code}",
-                )
 
-            response.raise_for_status()
-            data = response.json()
+        if proxy_url and ew:
+            ew.log(ew.DEBUG, f"Configure network proxy access with proxy={proxy_url}")
 
-            cursor = data["next_cursor"]
+        if session is None:
+            session = FeedSession(feed_id, api_key, proxy_url=proxy_url)
 
-            yield (cursor, data["items"])
+        if page_sizer is None:
+            page_sizer = PageSizer()
 
-            if not data["items"] or len(data["items"]) < LIMIT:
-                break
+        url = self.get_feed_url(feed_id, api_root_url)
 
-    # Convert a STIX 2.1 Indicator to Splunk key-value objects
-    def indicator_to_kv(self, indicator, api_root_url):
-        results = defaultdict(list)
-        pattern_type = indicator.get("pattern_type")
+        page_number = 0
+        while True:
+            page_number += 1
+            page_size = page_sizer.page_size
+            paginated_url = get_page_url(url, page_size, cursor)
 
-        if pattern_type is not None and pattern_type != "stix":
-            print(
-                "WARNING Unsupported pattern type '{}'".format(pattern_type),
-                file=sys.stderr,
-            )
-            return results
+            try:
+                if streaming:
+                    page = session.stream_page(paginated_url)
+                else:
+                    page = session.get_page(paginated_url)
+            except Exception:
+                page_sizer.record_error()
+                raise
+
+            try:
+                yield page
+
+                # Streamed pages are only complete once all their indicators are read
+                page.finish()
+            finally:
+                page.close()
+
+            page_sizer.record_page(page.size, page.transfer)
+            if ew:
+                self.log_page(ew, paginated_url, page)
+
+            cursor = page.next_cursor
 
-        parsed_pattern = Pattern(indicator["pattern"])
+            if page.last:
+                break
+
+            if max_pages > 0 and page_number >= max_pages:
+                break
 
-        for observable_type, comparisons in six.iteritems(
-            parsed_pattern.inspect().comparisons
-        ):
-            for path, operator, value in comparisons:
+    def pattern_to_kv(self, pattern, comparisons):
+        """
+        Returns the IOC types and KV keys of the supported comparisons of a
+        pattern, with the reasons and observable types of the skipped ones
+        """
+        keys = []
+        skipped = []
+
+        for observable_type, type_comparisons in six.iteritems(comparisons):
+            for path, operator, value in type_comparisons:
                 if observable_type not in SUPPORTED_TYPES:
-                    print(
-                        "WARNING Unsupported type '{}' in pattern '{}'".format(
-                            observable_type, indicator["pattern"]
-                        ),
-                        file=sys.stderr,
-                    )
+                    skipped.append((UNSUPPORTED_TYPE, observable_type))
                     continue
 
                 try:
                     path = ".".join(path)
                 except TypeError:
                     # This happends when the pattern contains '*', which is unsupported by the Splunk App
-                    print(
-                        "WARNING Unsupported path '*' in pattern '{}'".format(
-                            indicator["pattern"]
-                        ),
-                        file=sys.stderr,
-                    )
+                    skipped.append((UNSUPPORTED_PATH, observable_type))
                     continue
 
                 if path not in SUPPORTED_TYPES[observable_type]:
-                    print(
-                        "WARNING Unsupported path '{}' in pattern '{}'".format(
-                            path, indicator["pattern"]
-                        ),
-                        file=sys.stderr,
-                    )
+                    skipped.append((UNSUPPORTED_PATH, observable_type))
                     continue
 
                 if operator != "=":
-                    print(
-                        "WARNING Unsupported operator '{}' in pattern '{}'".format(
-                            operator, indicator["pattern"]
-                        ),
-                        file=sys.stderr,
-                    )
+                    skipped.append((UNSUPPORTED_OPERATOR, observable_type))
                     continue
 
                 # KV store that hosts the IOC leverage
@@ -237,105 +604,643 @@ class SEKOIAIndicators(Script):
                 #
                 # Unfortunately, Splunk Accelerated Fields
                 # cannot be larger than 1024.
-                if len(value.strip("'")) <= 1024:
+                value = value.strip("'")
+                if len(value) <= 1024:
+                    # Applying _key to lowercase to avoid case sensitivity
+                    keys.append((SUPPORTED_TYPES[observable_type][path], value.lower()))
+                else:
+                    skipped.append((VALUE_TOO_LONG, observable_type))
 
-                    if not api_root_url:
-                        server_root_url = "https://app.sekoia.io"
-                    else:
-                        server_root_url = api_root_url
-                        if server_root_url.endswith("/api"):
-                            server_root_url = server_root_url[:-4]
-                        elif server_root_url.endswith("/api/"):
-                            server_root_url = server_root_url[:-5]
+        return keys, skipped
 
-                    # Applying _key to lowercase to avoid case sensitivity
-                    result = {
-                        "_key": value.strip("'").lower(),
-                        "indicator_id": indicator["id"],
-                        "server_root_url": server_root_url,
-                        "valid_until": indicator.get("valid_until"),
-                    }
-
-                    if indicator.get("valid_until"):
-                        try:
-                            result["valid_until"] = int(
-                                time.mktime(
-                                    datetime.strptime(
-                                        indicator["valid_until"][:19], "%Y-%m-%dT%H:%M:%S"
-                                    ).timetuple()
-                                )
-                            )
-
-                        except ValueError:
-                            print(
-                                "WARNING Incorrect `valid_until` '{}' in pattern '{}'".format(
-                                    indicator["valid_until"], indicator["pattern"]
-                                ),
-                                file=sys.stderr,
-                            )
-                            continue
-
-                    results[SUPPORTED_TYPES[observable_type][path]].append(result)
+    # Convert a page of STIX 2.1 Indicators to Splunk key-value objects
+    def indicators_to_kv(self, indicators, api_root_url):
+        """
+        Converts the indicators of a page into the KV documents to save and
+        the ones to revoke, per IOC type, with the diagnostics of what was
+        skipped.
+
+        The work shared by the indicators is done once per page: the server
+        url, the comparisons of each distinct pattern and the conversion of
+        each distinct `valid_until` to the UTC epoch, which is both stored
+        and compared to the current time.
+        """
+        objects = defaultdict(list)
+        revoked = defaultdict(list)
+        diagnostics = ConversionDiagnostics()
+        now = time.time()
+        server_root_url = get_server_root_url(api_root_url)
+
+        # Distinct patterns, compiled together
+        patterns = list(
+            dict.fromkeys(
+                indicator["pattern"]
+                for indicator in indicators
+                if indicator.get("pattern_type") in (None, "stix")
+            )
+        )
+        pattern_keys = {
+            pattern: self.pattern_to_kv(pattern, comparisons)
+            for pattern, comparisons in zip(
+                patterns, self._patterns.extract_many(patterns)
+            )
+        }
 
-        return results
+        # Distinct `valid_until`, converted once
+        timestamps = {
+            indicator["valid_until"]: rfc3339_to_timestamp(indicator["valid_until"])
+            for indicator in indicators
+            if indicator.get("valid_until")
+        }
+
+        for indicator in indicators:
+            pattern_type = indicator.get("pattern_type")
+
+            if pattern_type is not None and pattern_type != "stix":
+                diagnostics.add(
+                    UNSUPPORTED_PATTERN_TYPE, pattern_type, indicator["pattern"]
+                )
+                continue
+
+            keys, skipped = pattern_keys[indicator["pattern"]]
+            for reason, observable_type in skipped:
+                diagnostics.add(reason, observable_type, indicator["pattern"])
+
+            if not keys:
+                continue
+
+            valid_until = indicator.get("valid_until")
+            if valid_until:
+                timestamp = timestamps[valid_until]
+
+                if timestamp is None:
+                    for ioc_type, _ in keys:
+                        diagnostics.add(INCORRECT_VALID_UNTIL, ioc_type, valid_until)
+                    continue
+            else:
+                timestamp = valid_until
+
+            if indicator.get("revoked", False):
+                documents = revoked
+            # Only import IOCs with a Valid Until date set
+            elif valid_until:
+                # Ignore expired indicators
+                if timestamp <= now:
+                    continue
+
+                documents = objects
+            else:
+                continue
+
+            for ioc_type, key in keys:
+                documents[ioc_type].append(
+                    IOCRecord(key, indicator["id"], server_root_url, timestamp)
+                )
+
+        return objects, revoked, diagnostics
+
+    def log_argument_errors(self, ew, inputs):
+        """
+        Logs the invalid arguments of the inputs, replaced by their default
+        """
+        for input_name, input_item in sorted(six.iteritems(inputs.inputs)):
+            for error in get_argument_errors(input_item):
+                ew.log(
+                    ew.ERROR,
+                    f"Input {input_name}: {error}, the default value is used instead",
+                )
+
+    def log_page(self, ew, paginated_url, page):
+        """
+        Logs the size and the transfer of a page of the feed
+        """
+        ew.log(
+            ew.DEBUG,
+            f"API call on {paginated_url} returned {page.size} indicators "
+            f"({page.transfer['wire_bytes']} bytes on the wire, "
+            f"{page.transfer['decoded_bytes']} bytes decompressed)",
+        )
+
+    def log_session_stats(self, ew, feed_id, session, stats_before):
+        """
+        Logs the requests and connections of the feed session since
+        `stats_before`
+        """
+        stats = session.stats()
+        cycle = {key: value - stats_before[key] for key, value in six.iteritems(stats)}
+        ew.log(
+            ew.INFO,
+            f"HTTP session of feed {feed_id}: {cycle['requests']} requests "
+            f"({cycle['retries']} retried), "
+            f"{cycle['connections']} connections opened, {cycle['reused']} reused, "
+            f"{cycle['wire_bytes']} bytes on the wire for "
+            f"{cycle['decoded_bytes']} bytes decompressed",
+        )
+
+    def log_pattern_stats(self, ew, stats_before):
+        """
+        Logs how the patterns were read since `stats_before`
+        """
+        stats = self._patterns.stats()
+        cycle = {key: stats[key] - stats_before[key] for key in stats_before}
+
+        if cycle["hits"] or cycle["misses"]:
+            ew.log(
+                ew.INFO,
+                f"Read {cycle['fast_path']} patterns with the fast path "
+                f"and parsed {cycle['fallback']} with stix2patterns",
+            )
+            ew.log(
+                ew.INFO,
+                f"Pattern cache: {cycle['hits']} hits, {cycle['misses']} misses, "
+                f"{cycle['evictions']} evictions, {stats['entries']} patterns "
+                f"cached in {stats['cache_bytes'] // 1024} KiB",
+            )
+
+    def log_digest_stats(self, ew, stats_before):
+        """
+        Logs how many IOCs the digest index skipped since `stats_before`
+        """
+        if self._digests is None or stats_before is None:
+            return
+
+        stats = self._digests.stats()
+        cycle = {key: stats[key] - stats_before[key] for key in stats_before}
+
+        if cycle["unchanged"] or cycle["superseded"] or cycle["changed"]:
+            ew.log(
+                ew.INFO,
+                f"Digest index: skipped {cycle['unchanged']} unchanged IOCs and "
+                f"{cycle['superseded']} IOCs expiring before the saved ones, "
+                f"{cycle['changed']} new or changed IOCs to save",
+            )
+        if cycle["errors"]:
+            ew.log(
+                ew.WARN,
+                f"Digest index: {cycle['errors']} errors of {self._digests.path}, "
+                f"the IOCs were saved anyway",
+            )
+
+    def log_diagnostics(self, ew, feed_id, diagnostics):
+        """
+        Logs what the conversion skipped during the run of a feed
+        """
+        if diagnostics:
+            ew.log(
+                ew.WARN,
+                f"Skipped while converting the indicators of feed {feed_id}: "
+                f"{diagnostics.summary()}",
+            )
+
+    def log_splunkd_stats(self, ew, stats_before):
+        """
+        Logs the requests sent to splunkd during the cycle, and the
+        connections opened for them
+        """
+        stats = self.get_splunkd_handler().stats()
+        requests_sent = stats["requests"] - stats_before["requests"]
+
+        if requests_sent:
+            ew.log(
+                ew.INFO,
+                f"splunkd connections: {requests_sent} requests, "
+                f"{stats['connections'] - stats_before['connections']} "
+                f"connections opened",
+            )
+
+    def load_dfa_cache(self, checkpoint_dir, ew):
+        """
+        Restores the DFA of the STIX pattern parser saved in the checkpoint
+        directory, once per process
+        """
+        if self._dfa_cache is not None:
+            return
+
+        self._dfa_cache = DFACache(checkpoint_dir)
+        if self._dfa_cache.load():
+            ew.log(ew.INFO, "Restored the DFA cache of the STIX pattern parser")
+
+    def save_dfa_cache(self, ew):
+        """
+        Saves the DFA of the STIX pattern parser in the checkpoint directory,
+        when they grew
+        """
+        if self._dfa_cache is None:
+            return
+
+        try:
+            if self._dfa_cache.save():
+                ew.log(ew.DEBUG, "Saved the DFA cache of the STIX pattern parser")
+        except Exception as error:
+            ew.log(
+                ew.WARN,
+                f"Failed to save the DFA cache of the STIX pattern parser: {error}",
+            )
 
     # Get IOC Type Key-Value stores on demand
     def get_kvstore(self, ioc_type):
         store_name = COLLECTION_NAME.format(ioc_type)
 
-        if store_name not in self._kv_stores:
+        with self._kv_stores_lock:
+            if store_name not in self._kv_stores:
 
-            # Create KV Store if it doesn't exist
-            if store_name not in self._splunk.kvstore:
-                self._splunk.kvstore.create(store_name)
+                # Create KV Store if it doesn't exist
+                if store_name not in self._splunk.kvstore:
+                    self._splunk.kvstore.create(store_name)
+                    if self._digests is not None:
+                        self._digests.clear(store_name)
 
-            self._kv_stores[store_name] = self._splunk.kvstore[store_name].data
+                self._kv_stores[store_name] = IOCCollectionData(
+                    self._splunk.kvstore[store_name]
+                )
 
         return self._kv_stores[store_name]
 
-    # Delete revoked indicator from Splunk KV-Stores
-    def revoke_indicator(self, kv_objects):
-        for ioc_type, objects in six.iteritems(kv_objects):
-            for obj in objects:
-                try:
-                    self.get_kvstore(ioc_type).delete_by_id(obj["_key"])
-                except Exception:
-                    pass
+    def kv_writer(self):
+        """
+        Holds one of the slots of the concurrent KV-Store writers
+        """
+        return self._kv_writers or nullcontext()
+
+    def convert_rows(self, rows, api_root_url):
+        """
+        Converts the indicator rows into the KV documents to save and the
+        ones to revoke, per IOC type, with the diagnostics of the conversion
+        """
+        return self.indicators_to_kv(
+            [dict(zip(INDICATOR_FIELDS, row)) for row in rows], api_root_url
+        )
+
+    def get_conversion_executor(self, inputs):
+        """
+        Returns the pool of processes converting the indicators,
+        None when they are converted by the ingesting worker
+        """
+        shared = get_shared_arguments(inputs)
+        workers = get_int_argument(shared, "conversion_workers", 0)
+        cache_size = get_pattern_cache_size(inputs)
+        two_stage = get_two_stage_parsing(inputs)
+
+        configuration = (workers, cache_size, two_stage)
+        if configuration == self._conversion_executor_configuration:
+            return self._conversion_executor
+
+        if self._conversion_executor is not None:
+            self._conversion_executor.shutdown(wait=True)
+            self._patterns.forget_process_caches()
+
+        self._conversion_executor = None
+        self._conversion_executor_configuration = configuration
+
+        if workers > 0:
+            self._conversion_executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_conversion_process,
+                initargs=(cache_size, two_stage, inputs.metadata["checkpoint_dir"]),
+            )
+
+        return self._conversion_executor
+
+    def submit_conversion(self, indicators, api_root_url):
+        """
+        Splits the indicators between the conversion processes,
+        returns the futures of their conversions
+        """
+        rows = get_indicator_rows(indicators)
+        workers = self._conversion_executor_configuration[0]
+        chunk_size = max(-(-len(rows) // workers), MIN_CONVERSION_CHUNK)
+
+        return [
+            self._conversion_executor.submit(
+                _convert_in_process, rows[start : start + chunk_size], api_root_url
+            )
+            for start in range(0, len(rows), chunk_size)
+        ]
+
+    def convert_indicators(self, indicators, api_root_url):
+        """
+        Converts the indicators into the KV documents to save and the ones
+        to revoke, per IOC type, with the diagnostics of the conversion
+        """
+        if self._conversion_executor is None:
+            return self.indicators_to_kv(indicators, api_root_url)
+
+        objects, revoked, diagnostics, pattern_stats = merge_conversions(
+            future.result()
+            for future in self.submit_conversion(indicators, api_root_url)
+        )
+        self._patterns.add_process_stats(pattern_stats)
+
+        return objects, revoked, diagnostics
+
+    async def async_convert_indicators(self, indicators, api_root_url):
+        """
+        Converts the indicators, without blocking the event loop while the
+        conversion processes work, or while a thread converts them without
+        conversion processes
+        """
+        if self._conversion_executor is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.convert_indicators, indicators, api_root_url
+            )
+
+        objects, revoked, diagnostics, pattern_stats = merge_conversions(
+            await asyncio.gather(
+                *[
+                    asyncio.wrap_future(future)
+                    for future in self.submit_conversion(indicators, api_root_url)
+                ]
+            )
+        )
+        self._patterns.add_process_stats(pattern_stats)
+
+        return objects, revoked, diagnostics
 
     def store_indicators(self, indicators, ew, api_root_url):
         """
-        Stores the indicators in the Splunk KV-Stores
+        Stores the indicators in the Splunk KV-Stores,
+        returns the diagnostics of their conversion.
+
+        The indicators of a streamed page, an iterator rather than a list,
+        are converted and stored by batches of STREAM_BATCH_SIZE, so that
+        the page is never held in memory at once.
         """
-        objects = defaultdict(list)
-        now = datetime.utcnow()
+        if isinstance(indicators, list):
+            return self.flush_indicators(indicators, ew, api_root_url)
 
-        for indicator in indicators:
-            kv_objects = self.indicator_to_kv(indicator, api_root_url)
+        diagnostics = ConversionDiagnostics()
+        indicators = iter(indicators)
 
-            if indicator.get("revoked", False):
-                self.revoke_indicator(kv_objects)
-            # Only import IOCs with a Valid Until date set
-            elif indicator.get("valid_until"):
-                try:
-                    valid_until = from_rfc3339(indicator["valid_until"])
-                except ValueError:
-                    continue
+        while True:
+            batch = list(islice(indicators, STREAM_BATCH_SIZE))
+            if not batch:
+                return diagnostics
 
-                # Ignore expired indicators
-                if valid_until > now:
-                    for ioc_type, dicts in six.iteritems(kv_objects):
-                        objects[ioc_type] += dicts
+            diagnostics.merge(self.flush_indicators(batch, ew, api_root_url))
+
+    def flush_indicators(self, indicators, ew, api_root_url):
+        """
+        Converts a list of indicators and writes them in the KV-Stores,
+        returns the diagnostics of their conversion
+        """
+        objects, revoked, diagnostics = self.convert_indicators(
+            indicators, api_root_url
+        )
+        # revoked first: their keys are then unknown to the digest index, and
+        # an IOC of the page that still owns one of them is saved again
+        self.log_kv_writes(
+            ew, self.write_per_type(self.revoke_batch, revoked), self.log_revocation
+        )
+        objects = self.records_to_save(objects)
+        self.log_kv_writes(
+            ew, self.write_per_type(self.save_batch, objects), self.log_batch_save
+        )
+
+        return diagnostics
+
+    def write_per_type(self, write, batches):
+        """
+        Writes the batch of each IOC type in its KV-Store, concurrently when
+        there is a pool of KV-Store writers.
+        Returns the result, or the error, of each type.
+        """
+        if self._kv_write_executor is None:
+            return [
+                (ioc_type, write(ioc_type, batch))
+                for ioc_type, batch in six.iteritems(batches)
+            ]
+
+        futures = [
+            (ioc_type, self._kv_write_executor.submit(write, ioc_type, batch))
+            for ioc_type, batch in six.iteritems(batches)
+        ]
+        return [
+            (ioc_type, future.exception() or future.result())
+            for ioc_type, future in futures
+        ]
+
+    def records_to_save(self, objects):
+        """
+        Keeps, per IOC type, one record per key, with the latest
+        `valid_until`, and among them the ones that the digest index doesn't
+        know to be already saved unchanged, or with a later `valid_until`
+        """
+        records = {}
 
         for ioc_type, batch in six.iteritems(objects):
+            batch = latest_records(batch)
+            if self._digests is not None:
+                batch = self._digests.filter_changed(
+                    COLLECTION_NAME.format(ioc_type), batch
+                )
+            if batch:
+                records[ioc_type] = batch
+
+        return records
+
+    def check_digest_index(self, ew):
+        """
+        Forgets the digests of the IOC collections that are empty or missing,
+        e.g. after they were emptied or deleted outside of the modular input.
+        The digests of a collection that can't be checked are kept.
+        """
+        for ioc_type in IOC_TYPES:
+            store_name = COLLECTION_NAME.format(ioc_type)
             try:
-                self.get_kvstore(ioc_type).batch_save(*batch)
-            except HTTPError as http_error:
-                ew.log(ew.ERROR, "Failed to persist batch in kvstore")
-                ew.log(ew.ERROR, http_error)
+                documents = self.get_kvstore(ioc_type).query(limit=1, fields="_key")
+            except HTTPError as error:
+                if error.status != 404:
+                    ew.log(
+                        ew.ERROR,
+                        f"Failed to check the KV-Store collection {store_name}, "
+                        f"its digests are kept: {error}",
+                    )
+                    continue
 
-            ew.log(
-                ew.INFO, f"Saved KVStore Batch of {len(batch)} IOCs of type {ioc_type}"
-            )
+                # deleted since it was cached: created again when it is saved
+                with self._kv_stores_lock:
+                    self._kv_stores.pop(store_name, None)
+                documents = []
+
+            if not documents:
+                self._digests.clear(store_name)
+
+    def forget_digests(self, ioc_type, keys):
+        """
+        Removes the keys of an IOC type from the digest index
+        """
+        if self._digests is not None:
+            self._digests.discard(COLLECTION_NAME.format(ioc_type), keys)
+
+    def on_saved(self, ioc_type):
+        """
+        Returns the callback recording the digests of the saved IOC records
+        """
+        if self._digests is None:
+            return None
+
+        return partial(self._digests.update, COLLECTION_NAME.format(ioc_type))
+
+    def revoke_batch(self, ioc_type, batch):
+        """
+        Deletes the revoked IOC records of a type from its KV-Store, in chunks
+        """
+        keys = [record.key for record in batch]
+        self.forget_digests(ioc_type, keys)
+
+        return self.get_kvstore(ioc_type).delete_keys(keys, writer=self.kv_writer())
+
+    def save_batch(self, ioc_type, batch):
+        """
+        Saves the IOC records of a type in its KV-Store, in chunks
+        """
+        return self.get_kvstore(ioc_type).save_records(
+            batch,
+            *self._batch_save_limits,
+            writer=self.kv_writer(),
+            on_saved=self.on_saved(ioc_type),
+        )
+
+    def log_kv_writes(self, ew, outcomes, log_result):
+        """
+        Logs the results, or the error, of the IOC types written concurrently.
+        The first error is raised once they are all logged: the page is then
+        read again from the same cursor.
+        """
+        failure = None
+
+        for ioc_type, outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                ew.log(
+                    ew.ERROR,
+                    f"Failed to write the IOCs of type {ioc_type} in kvstore: {outcome!r}",
+                )
+                failure = failure or outcome
+            else:
+                log_result(ew, ioc_type, outcome)
+
+        if failure is not None:
+            raise failure
+
+    def log_revocation(self, ew, ioc_type, result):
+        """
+        Logs the aggregated results of the chunks deleted from a KV-Store
+        """
+        for error in result["errors"]:
+            ew.log(ew.ERROR, "Failed to revoke IOCs in kvstore")
+            ew.log(ew.ERROR, error)
+
+        message = (
+            f"Revoked {result['deleted']} IOCs of type {ioc_type} "
+            f"in {result['chunks']} queries, {result['missing']} not found"
+        )
+        if result["failed"]:
+            message += f", {result['failed']} IOCs failed"
+        ew.log(ew.INFO, message)
+
+    def log_batch_save(self, ew, ioc_type, result):
+        """
+        Logs the aggregated results of the chunks saved in a KV-Store
+        """
+        for error in result["errors"]:
+            ew.log(ew.ERROR, "Failed to persist batch in kvstore")
+            ew.log(ew.ERROR, error)
+
+        message = (
+            f"Saved KVStore Batch of {result['saved']} IOCs of type {ioc_type} "
+            f"in {result['chunks']} requests"
+        )
+        if result["failed"]:
+            message += f", {result['failed']} IOCs failed"
+        ew.log(ew.INFO, message)
+
+    def get_batch_save_limits(self, inputs):
+        """
+        Returns the maximum number of documents and size in bytes of the
+        batch_save requests: the shared arguments, or the limits of splunkd
+        """
+        if self._splunkd_batch_save_limits is None:
+            self._splunkd_batch_save_limits = get_batch_save_limits(self._splunk)
+
+        max_documents, max_bytes = self._splunkd_batch_save_limits
+        shared = get_shared_arguments(inputs)
+        max_documents = get_int_argument(
+            shared, "max_documents_per_batch_save", max_documents
+        )
+        max_size = get_int_argument(shared, "max_size_per_batch_save_mb", 0)
+
+        return max_documents, max_size * 1024 * 1024 if max_size > 0 else max_bytes
+
+    async def get_async_kvstore(self, ioc_type):
+        """
+        Returns the asyncio client of the IOC Type Key-Value store, whose
+        collection is looked up, or created, by splunklib in a thread
+        """
+        if self._splunkd_client is None:
+            self._splunkd_client = AsyncHTTPClient(verify=False)
+
+        collection = await asyncio.get_running_loop().run_in_executor(
+            None, self.get_kvstore, ioc_type
+        )
+        return AsyncKVStoreCollectionData(collection, self._splunkd_client)
+
+    async def async_write_per_type(self, write, batches):
+        """
+        Writes the batch of each IOC type in its KV-Store, concurrently,
+        returns the result, or the error, of each type
+        """
+        ioc_types = list(batches)
+        results = await asyncio.gather(
+            *[write(ioc_type, batches[ioc_type]) for ioc_type in ioc_types],
+            return_exceptions=True,
+        )
+
+        return list(zip(ioc_types, results))
+
+    async def _async_revoke_batch(self, ioc_type, batch):
+        keys = [record.key for record in batch]
+        # the digest index is a SQLite database, kept off the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.forget_digests, ioc_type, keys
+        )
+
+        kvstore = await self.get_async_kvstore(ioc_type)
+        return await kvstore.delete_keys(keys, writer=self._async_kv_writers)
+
+    async def _async_save_batch(self, ioc_type, batch):
+        kvstore = await self.get_async_kvstore(ioc_type)
+        return await kvstore.save_records(
+            batch,
+            *self._batch_save_limits,
+            writer=self._async_kv_writers,
+            on_saved=self.on_saved(ioc_type),
+        )
+
+    async def async_store_indicators(self, indicators, ew, api_root_url):
+        """
+        Stores the indicators in the Splunk KV-Stores, from the event loop,
+        returns the diagnostics of their conversion
+        """
+        objects, revoked, diagnostics = await self.async_convert_indicators(
+            indicators, api_root_url
+        )
+        # revoked first, like in store_indicators
+        self.log_kv_writes(
+            ew,
+            await self.async_write_per_type(self._async_revoke_batch, revoked),
+            self.log_revocation,
+        )
+        objects = await asyncio.get_running_loop().run_in_executor(
+            None, self.records_to_save, objects
+        )
+        self.log_kv_writes(
+            ew,
+            await self.async_write_per_type(self._async_save_batch, objects),
+            self.log_batch_save,
+        )
+
+        return diagnostics
 
     # Describe the Modular Input and its arguments
     def get_scheme(self):
@@ -386,6 +1291,227 @@ class SEKOIAIndicators(Script):
         proxy_url.required_on_edit = False
         scheme.add_argument(proxy_url)
 
+        # page size
+        page_size = Argument("page_size")
+        page_size.title = "Page size"
+        page_size.data_type = Argument.data_type_number
+        page_size.description = (
+            "(Optional) Number of indicators requested per page "
+            "(default: {}).".format(DEFAULT_PAGE_SIZE)
+        )
+        page_size.required_on_create = False
+        page_size.required_on_edit = False
+        scheme.add_argument(page_size)
+
+        # adaptive page size
+        adaptive_page_size = Argument("adaptive_page_size")
+        adaptive_page_size.title = "Adaptive page size"
+        adaptive_page_size.data_type = Argument.data_type_boolean
+        adaptive_page_size.description = (
+            "(Optional) Grow or shrink the page size according to the observed "
+            "latency, size and errors of the pages (default: false)."
+        )
+        adaptive_page_size.required_on_create = False
+        adaptive_page_size.required_on_edit = False
+        scheme.add_argument(adaptive_page_size)
+
+        # streamed pages
+        stream_pages = Argument("stream_pages")
+        stream_pages.title = "Stream pages"
+        stream_pages.data_type = Argument.data_type_boolean
+        stream_pages.description = (
+            "(Optional) Decode the indicators one at a time while the pages are read, "
+            "and store them by batches of 200, to bound the memory usage to one "
+            "batch of indicators instead of one page. "
+            "Pages are not prefetched in this mode (default: false)."
+        )
+        stream_pages.required_on_create = False
+        stream_pages.required_on_edit = False
+        scheme.add_argument(stream_pages)
+
+        # run mode
+        run_mode = Argument("run_mode")
+        run_mode.title = "Run mode"
+        run_mode.data_type = Argument.data_type_string
+        run_mode.description = (
+            "(Optional) Ingest the feeds with blocking workers (sync) or concurrently "
+            "from one asyncio event loop (asyncio), shared by all the inputs "
+            "(default: sync). The asyncio mode reads each page whole and fetches "
+            "one page ahead, ignoring stream_pages, prefetch_pages, feed_workers "
+            "and feed_worker_mode."
+        )
+        run_mode.required_on_create = False
+        run_mode.required_on_edit = False
+        scheme.add_argument(run_mode)
+
+        # feed workers
+        feed_workers = Argument("feed_workers")
+        feed_workers.title = "Feed workers"
+        feed_workers.data_type = Argument.data_type_number
+        feed_workers.description = (
+            "(Optional) Number of feeds ingested concurrently, shared by all the inputs "
+            "(default: {}, the feeds are ingested one after the other).".format(
+                DEFAULT_FEED_WORKERS
+            )
+        )
+        feed_workers.required_on_create = False
+        feed_workers.required_on_edit = False
+        scheme.add_argument(feed_workers)
+
+        # feed worker mode
+        feed_worker_mode = Argument("feed_worker_mode")
+        feed_worker_mode.title = "Feed worker mode"
+        feed_worker_mode.data_type = Argument.data_type_string
+        feed_worker_mode.description = (
+            "(Optional) Run the feed workers as threads or as processes, "
+            "shared by all the inputs (thread or process, default: thread)."
+        )
+        feed_worker_mode.required_on_create = False
+        feed_worker_mode.required_on_edit = False
+        scheme.add_argument(feed_worker_mode)
+
+        # api rate limit
+        api_rate_limit = Argument("api_rate_limit")
+        api_rate_limit.title = "API rate limit"
+        api_rate_limit.data_type = Argument.data_type_number
+        api_rate_limit.description = (
+            "(Optional) Maximum number of requests per second sent to one SEKOIA.IO API, "
+            "shared by all the inputs and feed worker processes "
+            "(default: {}, 0 for no limit).".format(DEFAULT_API_RATE_LIMIT)
+        )
+        api_rate_limit.required_on_create = False
+        api_rate_limit.required_on_edit = False
+        scheme.add_argument(api_rate_limit)
+
+        # conversion workers
+        conversion_workers = Argument("conversion_workers")
+        conversion_workers.title = "Conversion workers"
+        conversion_workers.data_type = Argument.data_type_number
+        conversion_workers.description = (
+            "(Optional) Number of processes converting the indicators to KV-Store "
+            "documents, shared by all the inputs (default: 0, no conversion process)."
+        )
+        conversion_workers.required_on_create = False
+        conversion_workers.required_on_edit = False
+        scheme.add_argument(conversion_workers)
+
+        # pattern cache size
+        pattern_cache_size = Argument("pattern_cache_size")
+        pattern_cache_size.title = "Pattern cache size"
+        pattern_cache_size.data_type = Argument.data_type_number
+        pattern_cache_size.description = (
+            "(Optional) Memory, in MB, of the cache of the parsed patterns, "
+            "shared by all the inputs (default: {}, 0 to disable).".format(
+                DEFAULT_PATTERN_CACHE_SIZE
+            )
+        )
+        pattern_cache_size.required_on_create = False
+        pattern_cache_size.required_on_edit = False
+        scheme.add_argument(pattern_cache_size)
+
+        # two-stage pattern parsing
+        two_stage_pattern_parsing = Argument("two_stage_pattern_parsing")
+        two_stage_pattern_parsing.title = "Two-stage pattern parsing"
+        two_stage_pattern_parsing.data_type = Argument.data_type_boolean
+        two_stage_pattern_parsing.description = (
+            "(Optional) Parse the STIX patterns that aren't simple equalities "
+            "with the SLL prediction mode first, and with the full LL prediction "
+            "only when it fails (default: false)."
+        )
+        two_stage_pattern_parsing.required_on_create = False
+        two_stage_pattern_parsing.required_on_edit = False
+        scheme.add_argument(two_stage_pattern_parsing)
+
+        # kvstore writers
+        kvstore_writers = Argument("kvstore_writers")
+        kvstore_writers.title = "KV-Store writers"
+        kvstore_writers.data_type = Argument.data_type_number
+        kvstore_writers.description = (
+            "(Optional) Maximum number of concurrent writes in the KV-Stores, "
+            "shared by all the inputs (default: 0, one per IOC type for each "
+            "feed worker)."
+        )
+        kvstore_writers.required_on_create = False
+        kvstore_writers.required_on_edit = False
+        scheme.add_argument(kvstore_writers)
+
+        max_documents_per_batch_save = Argument("max_documents_per_batch_save")
+        max_documents_per_batch_save.title = "Maximum documents per KV-Store batch"
+        max_documents_per_batch_save.data_type = Argument.data_type_number
+        max_documents_per_batch_save.description = (
+            "(Optional) Maximum number of IOCs saved per request in the KV-Stores, "
+            "shared by all the inputs (default: max_documents_per_batch_save "
+            "of the [kvstore] stanza of limits.conf)."
+        )
+        max_documents_per_batch_save.required_on_create = False
+        max_documents_per_batch_save.required_on_edit = False
+        scheme.add_argument(max_documents_per_batch_save)
+
+        max_size_per_batch_save_mb = Argument("max_size_per_batch_save_mb")
+        max_size_per_batch_save_mb.title = "Maximum size of a KV-Store batch"
+        max_size_per_batch_save_mb.data_type = Argument.data_type_number
+        max_size_per_batch_save_mb.description = (
+            "(Optional) Maximum size, in MB, of the requests saving IOCs in the "
+            "KV-Stores, shared by all the inputs (default: "
+            "max_size_per_batch_save_mb of the [kvstore] stanza of limits.conf)."
+        )
+        max_size_per_batch_save_mb.required_on_create = False
+        max_size_per_batch_save_mb.required_on_edit = False
+        scheme.add_argument(max_size_per_batch_save_mb)
+
+        # digest index ttl
+        digest_index_ttl = Argument("digest_index_ttl")
+        digest_index_ttl.title = "Digest index TTL"
+        digest_index_ttl.data_type = Argument.data_type_number
+        digest_index_ttl.description = (
+            "(Optional) Time, in seconds, during which an IOC saved in the "
+            "KV-Stores isn't saved again while it is unchanged, shared by all "
+            "the inputs (default: 86400, 0 to save every IOC)."
+        )
+        digest_index_ttl.required_on_create = False
+        digest_index_ttl.required_on_edit = False
+        scheme.add_argument(digest_index_ttl)
+
+        # poll interval
+        poll_interval = Argument("poll_interval")
+        poll_interval.title = "Poll interval"
+        poll_interval.data_type = Argument.data_type_number
+        poll_interval.description = (
+            "(Optional) Delay, in seconds, between two polls of the feed "
+            "(default: {}). Idle feeds are polled up to 4 times less often.".format(
+                DEFAULT_POLL_INTERVAL
+            )
+        )
+        poll_interval.required_on_create = False
+        poll_interval.required_on_edit = False
+        scheme.add_argument(poll_interval)
+
+        # max pages per run
+        max_pages = Argument("max_pages_per_run")
+        max_pages.title = "Maximum pages per run"
+        max_pages.data_type = Argument.data_type_number
+        max_pages.description = (
+            "(Optional) Number of pages read before letting the other feeds run, "
+            "the feed is then resumed right away (default: {}, 0 for no limit).".format(
+                DEFAULT_MAX_PAGES_PER_RUN
+            )
+        )
+        max_pages.required_on_create = False
+        max_pages.required_on_edit = False
+        scheme.add_argument(max_pages)
+
+        # prefetch pages
+        prefetch = Argument("prefetch_pages")
+        prefetch.title = "Prefetched pages"
+        prefetch.data_type = Argument.data_type_number
+        prefetch.description = (
+            "(Optional) Number of feed pages fetched ahead while the current page is stored "
+            "(default: {}, 0 disables the prefetching).".format(DEFAULT_PREFETCH_PAGES)
+        )
+        prefetch.required_on_create = False
+        prefetch.required_on_edit = False
+        scheme.add_argument(prefetch)
+
         return scheme
 
     # Validate the Modular Input's configuration
@@ -395,8 +1521,12 @@ class SEKOIAIndicators(Script):
         to check the configuration is valid.
 
         It performs the following checks:
+        - checks the integer and choice arguments
         - checks it can connects to the feed to retrieve few indicators
         """
+        errors = get_argument_errors(definition.parameters)
+        if errors:
+            raise Exception(f"Invalid arguments: {'; '.join(errors)}")
 
         try:
             feed_id = definition.parameters["feed_id"] or DEFAULT_FEED
@@ -406,29 +1536,415 @@ class SEKOIAIndicators(Script):
             if api_key == MASK:
                 return True
 
-            (cursor, indicators) = next(
-                self.get_indicators(
-                    feed_id=feed_id,
-                    api_key=api_key,
-                    api_root_url=api_root_url,
-                    proxy_url=proxy_url,
+            # The configuration page waits for the check, which is not retried
+            session = FeedSession(feed_id, api_key, proxy_url=proxy_url, max_retries=0)
+            try:
+                next(
+                    self.get_indicators(
+                        feed_id=feed_id,
+                        api_key=api_key,
+                        api_root_url=api_root_url,
+                        proxy_url=proxy_url,
+                        session=session,
+                    )
                 )
-            )
+            finally:
+                session.close()
         except requests.exceptions.HTTPError as http_error:
             raise Exception(f"Failed to connect on SEKOIA.IO feed: {http_error}")
 
         return True
 
+    def ingest_feed(self, inputs, input_name, input_item, ew):
+        """
+        Fetches and stores the new indicators of one input.
+
+        At most `max_pages_per_run` pages are read per run: the feed is not
+        `drained` when the run stops on that limit. Errors are logged and
+        never reach the other inputs.
+        """
+        ew.log(ew.INFO, f"Fetch the indicators for input {input_name}")
+        result = {"indicators": 0, "drained": True}
+        diagnostics = ConversionDiagnostics()
+
+        try:
+            feed_id = get_feed_id(input_item)
+            proxy_url = input_item.get("proxy_url")
+            api_root_url = input_item.get("api_root_url")
+            api_key = self._get_api_key_from_secured_storage(feed_id=feed_id)
+            cursor = self.get_cursor(inputs, feed_id)
+            rate_limit = get_int_argument(
+                get_shared_arguments(inputs), "api_rate_limit", DEFAULT_API_RATE_LIMIT
+            )
+            session = self.get_feed_session(
+                feed_id, api_key, proxy_url, api_root_url, rate_limit
+            )
+            stats_before = session.stats()
+            prefetch = get_int_argument(
+                input_item, "prefetch_pages", DEFAULT_PREFETCH_PAGES
+            )
+
+            page_sizer = self.get_page_sizer(
+                feed_id,
+                get_int_argument(input_item, "page_size", DEFAULT_PAGE_SIZE),
+                get_bool_argument(input_item, "adaptive_page_size", False),
+            )
+
+            streaming = get_bool_argument(input_item, "stream_pages", False)
+            max_pages = get_int_argument(
+                input_item, "max_pages_per_run", DEFAULT_MAX_PAGES_PER_RUN
+            )
+
+            pages = self.get_indicators(
+                feed_id=feed_id,
+                api_key=api_key,
+                api_root_url=api_root_url,
+                proxy_url=proxy_url,
+                cursor=cursor,
+                ew=ew,
+                session=session,
+                page_sizer=page_sizer,
+                streaming=streaming,
+                max_pages=max_pages,
+            )
+            # Streamed pages are read while they are stored,
+            # the next one can't be fetched ahead
+            if prefetch > 0 and not streaming:
+                # Fetch the next pages while the current one is stored
+                pages = prefetch_pages(pages, prefetch)
+
+            for page_number, page in enumerate(pages, 1):
+                diagnostics.merge(self.store_indicators(page.items, ew, api_root_url))
+                page.finish()
+                # Only move the checkpoint once the page is stored
+                self.store_cursor(inputs, feed_id, page.next_cursor)
+                result["indicators"] += page.size
+
+                if not page.last and max_pages > 0 and page_number >= max_pages:
+                    # Let the other feeds run, this one is resumed right after
+                    result["drained"] = False
+                    break
+
+            self.log_session_stats(ew, feed_id, session, stats_before)
+            self.log_diagnostics(ew, feed_id, diagnostics)
+
+        except Exception:
+            exception = traceback.format_exc()
+
+            for line in exception.splitlines():
+                ew.log(ew.ERROR, line)
+
+        return result
+
+    def get_async_feed_session(
+        self, feed_id, api_key, proxy_url=None, api_root_url=None, rate_limit=None
+    ):
+        """
+        Returns the asyncio session of the feed, kept across the cycles
+        """
+        rate_limiter = get_rate_limiter(api_root_url or BASE_URL, rate_limit)
+        session = self._async_feed_sessions.get(feed_id)
+
+        if session is None or not session.matches(api_key, proxy_url, rate_limiter):
+            if session is not None:
+                session.close()
+
+            session = AsyncFeedSession(
+                feed_id, api_key, proxy_url=proxy_url, rate_limiter=rate_limiter
+            )
+            self._async_feed_sessions[feed_id] = session
+
+        return session
+
+    async def _async_fetch_page(self, session, feed_url, cursor, page_sizer, ew):
+        page_size = page_sizer.page_size
+        paginated_url = get_page_url(feed_url, page_size, cursor)
+
+        try:
+            page = await session.get_page(paginated_url)
+        except Exception:
+            page_sizer.record_error()
+            raise
+
+        page_sizer.record_page(page.size, page.transfer)
+        self.log_page(ew, paginated_url, page)
+
+        return page
+
+    async def async_ingest_feed(self, inputs, input_name, input_item, ew):
+        """
+        Asyncio counterpart of ingest_feed: the next page is fetched while
+        the current one is stored, and the cursor only moves once its page
+        is stored.
+        """
+        ew.log(ew.INFO, f"Fetch the indicators for input {input_name}")
+        result = {"indicators": 0, "drained": True}
+        diagnostics = ConversionDiagnostics()
+        fetch = None
+
+        try:
+            feed_id = get_feed_id(input_item)
+            proxy_url = input_item.get("proxy_url")
+            api_root_url = input_item.get("api_root_url")
+            # splunklib's requests to the secured storage block
+            api_key = await asyncio.get_running_loop().run_in_executor(
+                None, self._get_api_key_from_secured_storage, feed_id
+            )
+            cursor = self.get_cursor(inputs, feed_id)
+            rate_limit = get_int_argument(
+                get_shared_arguments(inputs), "api_rate_limit", DEFAULT_API_RATE_LIMIT
+            )
+            session = self.get_async_feed_session(
+                feed_id, api_key, proxy_url, api_root_url, rate_limit
+            )
+            stats_before = session.stats()
+            page_sizer = self.get_page_sizer(
+                feed_id,
+                get_int_argument(input_item, "page_size", DEFAULT_PAGE_SIZE),
+                get_bool_argument(input_item, "adaptive_page_size", False),
+            )
+            max_pages = get_int_argument(
+                input_item, "max_pages_per_run", DEFAULT_MAX_PAGES_PER_RUN
+            )
+
+            ew.log(
+                ew.INFO,
+                f"Fetch indicators from feed_id={feed_id} (api_root_url={api_root_url})",
+            )
+            feed_url = self.get_feed_url(feed_id, api_root_url)
+
+            fetch = asyncio.ensure_future(
+                self._async_fetch_page(session, feed_url, cursor, page_sizer, ew)
+            )
+            page_number = 0
+
+            while fetch is not None:
+                page = await fetch
+                page_number += 1
+                fetch = None
+
+                if not page.last and max_pages > 0 and page_number >= max_pages:
+                    # Let the other feeds run, this one is resumed right after
+                    result["drained"] = False
+                elif not page.last:
+                    fetch = asyncio.ensure_future(
+                        self._async_fetch_page(
+                            session, feed_url, page.next_cursor, page_sizer, ew
+                        )
+                    )
+
+                diagnostics.merge(
+                    await self.async_store_indicators(page.items, ew, api_root_url)
+                )
+                # Only move the checkpoint once the page is stored
+                self.store_cursor(inputs, feed_id, page.next_cursor)
+                result["indicators"] += page.size
+
+            self.log_session_stats(ew, feed_id, session, stats_before)
+            self.log_diagnostics(ew, feed_id, diagnostics)
+
+        except Exception:
+            exception = traceback.format_exc()
+
+            for line in exception.splitlines():
+                ew.log(ew.ERROR, line)
+        finally:
+            if fetch is not None and not fetch.done():
+                fetch.cancel()
+
+        return result
+
+    async def _async_ingest_feeds(self, inputs, due_inputs, ew):
+        kv_writers = get_int_argument(
+            get_shared_arguments(inputs), "kvstore_writers", 0
+        )
+        self._async_kv_writers = (
+            asyncio.Semaphore(kv_writers) if kv_writers > 0 else None
+        )
+
+        return await asyncio.gather(
+            *[
+                self.async_ingest_feed(inputs, input_name, input_item, ew)
+                for input_name, input_item in due_inputs
+            ]
+        )
+
+    def ingest_feeds(self, inputs, due_inputs, ew):
+        """
+        Ingests the due inputs concurrently, from the pool of feed workers
+        or from the event loop of the asyncio run mode, or one after the
+        other without feed workers.
+        Returns the result of each input, in the order of `due_inputs`.
+        """
+        run_mode = get_choice_argument(
+            get_shared_arguments(inputs), "run_mode", RUN_MODES
+        )
+
+        if run_mode == "asyncio":
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+
+            return self._loop.run_until_complete(
+                self._async_ingest_feeds(inputs, due_inputs, ew)
+            )
+
+        executor = self.get_feed_executor(inputs)
+
+        if executor is None:
+            return [
+                self.ingest_feed(inputs, input_name, input_item, ew)
+                for input_name, input_item in due_inputs
+            ]
+
+        if isinstance(executor, ProcessPoolExecutor):
+            futures = [
+                executor.submit(_ingest_feed_in_process, inputs, input_name, input_item)
+                for input_name, input_item in due_inputs
+            ]
+        else:
+            futures = [
+                executor.submit(self.ingest_feed, inputs, input_name, input_item, ew)
+                for input_name, input_item in due_inputs
+            ]
+
+        results = []
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                ew.log(ew.ERROR, f"Feed worker failed: {error}")
+                results.append({"indicators": 0, "drained": True})
+            else:
+                results.append(future.result())
+
+        return results
+
+    def get_feed_executor(self, inputs):
+        """
+        Returns the pool of workers ingesting the feeds concurrently,
+        None when the feeds are ingested one after the other
+        """
+        shared = get_shared_arguments(inputs)
+        workers = get_int_argument(shared, "feed_workers", DEFAULT_FEED_WORKERS)
+        mode = get_choice_argument(shared, "feed_worker_mode", FEED_WORKER_MODES)
+        kv_writers = get_int_argument(shared, "kvstore_writers", 0)
+
+        # The worker processes share the rate limiters of the API roots
+        rate_limit = get_int_argument(shared, "api_rate_limit", DEFAULT_API_RATE_LIMIT)
+        api_root_urls = frozenset(
+            (input_item.get("api_root_url") or BASE_URL).rstrip("/")
+            for input_item in six.itervalues(inputs.inputs)
+        )
+
+        configuration = (workers, mode, kv_writers)
+        if mode == "process":
+            configuration += (rate_limit, api_root_urls)
+        if configuration == self._feed_executor_configuration:
+            return self._feed_executor
+
+        if self._feed_executor is not None:
+            self._feed_executor.shutdown(wait=True)
+
+        self._feed_executor = None
+        self._feed_executor_configuration = configuration
+        self._kv_writers = None
+
+        if workers <= 1:
+            return None
+
+        if mode == "process":
+            context = multiprocessing.get_context("spawn")
+            semaphore = context.BoundedSemaphore(kv_writers) if kv_writers > 0 else None
+            rate_limiters = get_shared_rate_limiters(api_root_urls, rate_limit, context)
+            self._feed_executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_feed_process,
+                initargs=(semaphore, rate_limiters),
+            )
+        else:
+            if kv_writers > 0:
+                self._kv_writers = threading.BoundedSemaphore(kv_writers)
+            self._feed_executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="sekoia-feed"
+            )
+
+        return self._feed_executor
+
+    def get_digest_index(self, inputs):
+        """
+        Returns the index of the digests of the saved IOCs,
+        None when it is disabled with a `digest_index_ttl` of 0
+        """
+        ttl = get_int_argument(
+            get_shared_arguments(inputs), "digest_index_ttl", DEFAULT_DIGEST_INDEX_TTL
+        )
+
+        if ttl <= 0:
+            if self._digests is not None:
+                self._digests.close()
+            self._digests = None
+        elif self._digests is None:
+            self._digests = DigestIndex(inputs.metadata["checkpoint_dir"], ttl)
+        else:
+            self._digests.ttl = ttl
+
+        return self._digests
+
+    def get_kv_write_executor(self, inputs):
+        """
+        Returns the pool of threads saving the IOC types of a page concurrently.
+
+        Its size is `kvstore_writers` when set, otherwise one thread per IOC
+        type for each feed worker thread.
+        """
+        shared = get_shared_arguments(inputs)
+        kv_writers = get_int_argument(shared, "kvstore_writers", 0)
+        mode = get_choice_argument(shared, "feed_worker_mode", FEED_WORKER_MODES)
+
+        if kv_writers > 0:
+            threads = kv_writers
+        else:
+            threads = len(IOC_TYPES)
+            if mode == "thread":
+                threads *= max(
+                    get_int_argument(shared, "feed_workers", DEFAULT_FEED_WORKERS), 1
+                )
+
+        if threads == self._kv_write_threads:
+            return self._kv_write_executor
+
+        if self._kv_write_executor is not None:
+            self._kv_write_executor.shutdown(wait=True)
+
+        self._kv_write_threads = threads
+        self._kv_write_executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="sekoia-kvstore"
+        )
+
+        return self._kv_write_executor
+
+    def get_scheduler(self, inputs):
+        """
+        Returns the scheduler of the feeds
+        """
+        if self._scheduler is None:
+            self._scheduler = FeedScheduler(inputs.metadata["checkpoint_dir"])
+
+        return self._scheduler
+
     # Method called by Splunk to get new events
     def stream_events(self, inputs, ew):
 
         while True:
 
             self._splunk = client.connect(
-                token=self._input_definition.metadata["session_key"], owner="nobody"
+                token=self._input_definition.metadata["session_key"],
+                owner="nobody",
+                handler=self.get_splunkd_handler(),
             )
 
             ew.log(ew.INFO, "Getting new events with the SEKOIA.IO modular input")
+            self.log_argument_errors(ew, inputs)
 
             session_key = self._input_definition.metadata["session_key"]
             # trigger the encryption of the api key if not yet performed
@@ -439,41 +1955,143 @@ class SEKOIAIndicators(Script):
                     self._store_api_key_in_secured_storage(feed_id, api_key, ew)
                     self._mask_api_key(session_key, input_name, feed_id, ew)
 
+            self._batch_save_limits = self.get_batch_save_limits(inputs)
+            self._patterns.set_cache_size(get_pattern_cache_size(inputs))
+            self._patterns.set_two_stage(get_two_stage_parsing(inputs))
+            self.load_dfa_cache(inputs.metadata["checkpoint_dir"], ew)
+            self.get_conversion_executor(inputs)
+            self.get_kv_write_executor(inputs)
+            digests = self.get_digest_index(inputs)
+            if digests is not None:
+                self.check_digest_index(ew)
+
+            scheduler = self.get_scheduler(inputs)
+            due_inputs = [
+                (input_name, input_item)
+                for input_name, input_item in sorted(six.iteritems(inputs.inputs))
+                if scheduler.is_due(
+                    get_feed_id(input_item), get_poll_interval(input_item)
+                )
+            ]
+
+            patterns_before = self._patterns.stats()
+            splunkd_before = self.get_splunkd_handler().stats()
+            digests_before = digests.stats() if digests is not None else None
+
             try:
-                for input_name, input_item in six.iteritems(inputs.inputs):
-                    ew.log(ew.INFO, f"Fetch the indicators for input {input_name}")
-                    try:
-                        feed_id = input_item.get("feed_id", "") or DEFAULT_FEED
-                        proxy_url = input_item.get("proxy_url")
-                        api_root_url = input_item.get("api_root_url")
-                        api_key = self._get_api_key_from_secured_storage(
-                            feed_id=feed_id
-                        )
-                        cursor = self.get_cursor(inputs, feed_id)
-
-                        for cursor, indicators in self.get_indicators(
-                            feed_id=feed_id,
-                            api_key=api_key,
-                            api_root_url=api_root_url,
-                            proxy_url=proxy_url,
-                            cursor=cursor,
-                            ew=ew,
-                        ):
-                            self.store_indicators(indicators, ew, api_root_url)
-                            self.store_cursor(inputs, feed_id, cursor)
-
-                    except Exception:
-                        exception = traceback.format_exc()
-
-                        for line in exception.splitlines():
-                            ew.log(ew.ERROR, line)
+                results = self.ingest_feeds(inputs, due_inputs, ew)
+
+                for (input_name, input_item), result in zip(due_inputs, results):
+                    delay = scheduler.reschedule(
+                        get_feed_id(input_item), get_poll_interval(input_item), **result
+                    )
+                    ew.log(
+                        ew.INFO,
+                        f"Read {result['indicators']} indicators for input {input_name}, "
+                        f"next run in {int(delay)} seconds",
+                    )
+
+                self.log_pattern_stats(ew, patterns_before)
+                self.log_splunkd_stats(ew, splunkd_before)
+                self.log_digest_stats(ew, digests_before)
+                self.save_dfa_cache(ew)
+                if digests is not None:
+                    digests.prune()
             finally:
+                next_run = min(
+                    scheduler.next_run(
+                        get_feed_id(input_item), get_poll_interval(input_item)
+                    )
+                    for input_item in six.itervalues(inputs.inputs)
+                )
+                delay = max(next_run - time.time(), 1)
                 ew.log(
                     ew.INFO,
-                    "Done fetching indicators of all the SEKOIA.IO inputs, sleeping for 10 minutes.",
+                    f"Done fetching indicators of the due SEKOIA.IO inputs, "
+                    f"sleeping for {int(delay)} seconds.",
                 )
-                time.sleep(600)
+                time.sleep(delay)
+
+
+# Script of the feed worker processes
+_feed_process = None
+
+
+def _init_feed_process(kv_writers, rate_limiters):
+    """
+    Initializes a feed worker process
+    """
+    global _feed_process
+
+    _feed_process = SEKOIAIndicators()
+    _feed_process._kv_writers = kv_writers
+    use_rate_limiters(rate_limiters)
+
+
+# Script of the conversion processes
+_conversion_process = None
+
+
+def _init_conversion_process(cache_size, two_stage, checkpoint_dir):
+    """
+    Initializes a conversion process
+    """
+    global _conversion_process
+
+    _conversion_process = SEKOIAIndicators()
+    _conversion_process._patterns.set_cache_size(cache_size)
+    _conversion_process._patterns.set_two_stage(two_stage)
+    _conversion_process.load_dfa_cache(checkpoint_dir, EventWriter())
+
+
+def _convert_in_process(rows, api_root_url):
+    """
+    Converts a chunk of indicator rows from a conversion process, returns
+    the conversion with the stats of its patterns
+    """
+    stats_before = _conversion_process._patterns.stats()
+    conversion = _conversion_process.convert_rows(rows, api_root_url)
+    _conversion_process.save_dfa_cache(EventWriter())
+
+    stats = _conversion_process._patterns.stats()
+    pattern_stats = {key: stats[key] - stats_before[key] for key in PATTERN_COUNTERS}
+    pattern_stats.update(
+        pid=os.getpid(), entries=stats["entries"], cache_bytes=stats["cache_bytes"]
+    )
+
+    return conversion + (pattern_stats,)
+
+
+def _ingest_feed_in_process(inputs, input_name, input_item):
+    """
+    Ingests one feed from a worker process
+    """
+    _feed_process._input_definition = inputs
+    _feed_process._splunk = client.connect(
+        token=inputs.metadata["session_key"],
+        owner="nobody",
+        handler=_feed_process.get_splunkd_handler(),
+    )
+    _feed_process._kv_stores = {}
+    _feed_process._batch_save_limits = _feed_process.get_batch_save_limits(inputs)
+    _feed_process.get_kv_write_executor(inputs)
+    digests = _feed_process.get_digest_index(inputs)
+    _feed_process._patterns.set_cache_size(get_pattern_cache_size(inputs))
+    _feed_process._patterns.set_two_stage(get_two_stage_parsing(inputs))
+
+    ew = EventWriter()
+    _feed_process.load_dfa_cache(inputs.metadata["checkpoint_dir"], ew)
+    patterns_before = _feed_process._patterns.stats()
+    splunkd_before = _feed_process.get_splunkd_handler().stats()
+    digests_before = digests.stats() if digests is not None else None
+    result = _feed_process.ingest_feed(inputs, input_name, input_item, ew)
+    _feed_process.log_pattern_stats(ew, patterns_before)
+    _feed_process.log_splunkd_stats(ew, splunkd_before)
+    _feed_process.log_digest_stats(ew, digests_before)
+    _feed_process.save_dfa_cache(ew)
+
+    return result
 
 
 if __name__ == "__main__":
-    sys.exit(SEKOIAIndicators().run(sys.argv))
\ No newline at end of file
+    sys.exit(SEKOIAIndicators().run(sys.argv))
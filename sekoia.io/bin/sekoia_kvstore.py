@@ -0,0 +1,338 @@
+"""
+Documents of the IOC KV-Stores and their serialization
+"""
+
+import json
+import sys
+from contextlib import nullcontext
+from json.encoder import encode_basestring_ascii
+from urllib.parse import quote
+
+from splunklib.binding import HTTPError
+from splunklib.client import KVStoreCollectionData
+
+# Defaults of the limits of batch_save in the [kvstore] stanza of limits.conf
+DEFAULT_MAX_DOCUMENTS_PER_BATCH_SAVE = 1000
+DEFAULT_MAX_SIZE_PER_BATCH_SAVE_MB = 50
+
+# Bounds of the keys of a query deleting IOCs, sent in the url
+MAX_KEYS_PER_DELETE = 100
+MAX_DELETE_QUERY_BYTES = 4096
+
+# Serialized IOC document, with the fields of the KV-Store collections
+_RECORD = '{"_key":%s,"indicator_id":%s,"server_root_url":%s,"valid_until":%s}'
+
+
+class IOCRecord(object):
+    """
+    KV-Store document of an IOC.
+
+    Records are much smaller than the equivalent dicts, and the server url,
+    shared by all of them, is interned. They are serialized straight to the
+    JSON sent to the KV-Stores by `dumps_records`.
+    """
+
+    __slots__ = ("key", "indicator_id", "server_root_url", "valid_until")
+
+    def __init__(self, key, indicator_id, server_root_url, valid_until):
+        self.key = key
+        self.indicator_id = indicator_id
+        self.server_root_url = sys.intern(server_root_url)
+        self.valid_until = valid_until
+
+    def __reduce__(self):
+        return (
+            IOCRecord,
+            (self.key, self.indicator_id, self.server_root_url, self.valid_until),
+        )
+
+    def __repr__(self):
+        return "IOCRecord({!r}, {!r}, {!r}, {!r})".format(
+            self.key, self.indicator_id, self.server_root_url, self.valid_until
+        )
+
+    def to_dict(self):
+        """
+        Returns the KV-Store document as a dict
+        """
+        return {
+            "_key": self.key,
+            "indicator_id": self.indicator_id,
+            "server_root_url": self.server_root_url,
+            "valid_until": self.valid_until,
+        }
+
+
+def latest_records(records):
+    """
+    Keeps one IOC record per key: the one with the latest `valid_until`,
+    the last one when they have the same `valid_until`
+    """
+    latest = {}
+
+    for record in records:
+        kept = latest.get(record.key)
+        if kept is None or record.valid_until >= kept.valid_until:
+            latest[record.key] = record
+
+    return list(latest.values())
+
+
+def _dumps_documents(records):
+    """
+    Serializes each IOC record to the JSON of its KV-Store document
+    """
+    server_root_urls = {}
+
+    for record in records:
+        server_root_url = server_root_urls.get(record.server_root_url)
+        if server_root_url is None:
+            server_root_url = encode_basestring_ascii(record.server_root_url)
+            server_root_urls[record.server_root_url] = server_root_url
+
+        key, indicator_id, valid_until = (
+            record.key,
+            record.indicator_id,
+            record.valid_until,
+        )
+        # strings and integer timestamps, the usual values, are encoded inline
+        yield _RECORD % (
+            encode_basestring_ascii(key) if type(key) is str else json.dumps(key),
+            (
+                encode_basestring_ascii(indicator_id)
+                if type(indicator_id) is str
+                else json.dumps(indicator_id)
+            ),
+            server_root_url,
+            valid_until if type(valid_until) is int else json.dumps(valid_until),
+        )
+
+
+def dumps_records(records):
+    """
+    Serializes IOC records to the JSON array of their KV-Store documents
+    """
+    return "[" + ",".join(_dumps_documents(records)) + "]"
+
+
+def dumps_record_chunks(records, max_documents, max_bytes):
+    """
+    Serializes IOC records to JSON arrays of at most `max_documents`
+    documents and `max_bytes` bytes, yields the records of each chunk and
+    their JSON.
+
+    A document larger than `max_bytes` is alone in its chunk.
+    """
+    records = list(records)
+    start = 0
+    chunk = []
+    size = 2
+
+    # The JSON is ASCII-only: its length is its size in bytes
+    for document in _dumps_documents(records):
+        if chunk and (
+            len(chunk) >= max_documents or size + len(document) + 1 > max_bytes
+        ):
+            yield records[start : start + len(chunk)], "[" + ",".join(chunk) + "]"
+            start += len(chunk)
+            chunk = []
+            size = 2
+
+        chunk.append(document)
+        size += len(document) + (1 if len(chunk) > 1 else 0)
+
+    if chunk:
+        yield records[start:], "[" + ",".join(chunk) + "]"
+
+
+def key_chunks(keys, max_keys=MAX_KEYS_PER_DELETE, max_bytes=MAX_DELETE_QUERY_BYTES):
+    """
+    Splits the distinct keys in lists of at most `max_keys` keys, whose
+    url-encoded query is at most `max_bytes` bytes.
+
+    A key whose query is larger than `max_bytes` is alone in its chunk.
+    """
+    chunk = []
+    size = 0
+
+    for key in dict.fromkeys(keys):
+        key_size = len(quote(json.dumps({"_key": key}))) + 3
+        if chunk and (len(chunk) >= max_keys or size + key_size > max_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+
+        chunk.append(key)
+        size += key_size
+
+    if chunk:
+        yield chunk
+
+
+def key_query(keys):
+    """
+    Returns the query of the KV-Store documents of the keys
+    """
+    return json.dumps({"$or": [{"_key": key} for key in keys]})
+
+
+def get_batch_save_limits(service):
+    """
+    Reads the limits of batch_save from the [kvstore] stanza of limits.conf,
+    returns the maximum number of documents and size in bytes of a request.
+    The defaults of splunkd are used when they can't be read.
+    """
+    limits = {
+        "max_documents_per_batch_save": DEFAULT_MAX_DOCUMENTS_PER_BATCH_SAVE,
+        "max_size_per_batch_save_mb": DEFAULT_MAX_SIZE_PER_BATCH_SAVE_MB,
+    }
+
+    try:
+        content = service.confs["limits"]["kvstore"].content
+        for name in limits:
+            if content.get(name):
+                limits[name] = int(content[name])
+    except Exception:
+        # limits.conf is not readable with the permissions of the input
+        pass
+
+    return (
+        limits["max_documents_per_batch_save"],
+        limits["max_size_per_batch_save_mb"] * 1024 * 1024,
+    )
+
+
+def new_batch_save_result():
+    """
+    Returns the aggregated results of the chunks of a batch_save
+    """
+    return {"chunks": 0, "saved": 0, "failed": 0, "errors": []}
+
+
+def new_delete_result():
+    """
+    Returns the aggregated results of the chunks of a deletion
+    """
+    return {"chunks": 0, "deleted": 0, "missing": 0, "failed": 0, "errors": []}
+
+
+def save_chunks(records, max_documents, max_bytes):
+    """
+    Saves IOC records in chunks that fit the limits of batch_save, with the
+    requests of a KV-Store client: yields the records and the JSON of each
+    chunk, and is sent back the documents saved from it or the error of its
+    request. Returns the aggregated results of the chunks.
+    """
+    result = new_batch_save_result()
+
+    for chunk, body in dumps_record_chunks(records, max_documents, max_bytes):
+        result["chunks"] += 1
+        saved = yield chunk, body
+
+        if isinstance(saved, Exception):
+            result["failed"] += len(chunk)
+            result["errors"].append(saved)
+        else:
+            result["saved"] += len(saved)
+
+    return result
+
+
+def delete_chunks(keys):
+    """
+    Deletes the IOCs of the keys with one query per chunk of keys, with the
+    requests of a KV-Store client: yields each chunk, and is sent back the
+    number of its keys found and deleted or the error of its requests.
+    Returns the aggregated results of the chunks.
+    """
+    result = new_delete_result()
+
+    for chunk in key_chunks(keys):
+        result["chunks"] += 1
+        found = yield (chunk,)
+
+        if isinstance(found, Exception):
+            result["failed"] += len(chunk)
+            result["errors"].append(found)
+        else:
+            result["deleted"] += found
+            result["missing"] += len(chunk) - found
+
+    return result
+
+
+def write_chunks(chunks, write):
+    """
+    Runs the writes of `save_chunks` or `delete_chunks` with the `write`
+    function, returns their results. HTTP errors only fail their chunk.
+    """
+    try:
+        request = next(chunks)
+        while True:
+            try:
+                outcome = write(*request)
+            except HTTPError as error:
+                outcome = error
+            request = chunks.send(outcome)
+    except StopIteration as stop:
+        return stop.value
+
+
+class IOCCollectionData(KVStoreCollectionData):
+    """
+    Data endpoint of an IOC KV-Store collection, saving IOC records
+    """
+
+    def _batch_save(self, body):
+        response = self._post("batch_save", headers=self.JSON_HEADER, body=body)
+        return json.loads(response.body.read().decode("utf-8"))
+
+    def batch_save(self, *documents):
+        """
+        Inserts or updates every IOC record specified in documents
+        """
+        if len(documents) < 1:
+            raise Exception("Must have at least one document.")
+
+        return self._batch_save(dumps_records(documents))
+
+    def save_records(
+        self, records, max_documents, max_bytes, writer=None, on_saved=None
+    ):
+        """
+        Inserts or updates the IOC records in chunks that fit the limits of
+        batch_save, each one written while holding `writer`. The records of
+        each saved chunk are passed to `on_saved`.
+        Returns the aggregated results of the chunks.
+        """
+
+        def save(chunk, body):
+            with writer or nullcontext():
+                saved = self._batch_save(body)
+            if on_saved is not None:
+                on_saved(chunk)
+
+            return saved
+
+        return write_chunks(save_chunks(records, max_documents, max_bytes), save)
+
+    def delete_keys(self, keys, writer=None):
+        """
+        Deletes the IOCs of the keys with one query per chunk of keys, each
+        one written while holding `writer`.
+        The keys found by a query are deleted, the others are missing.
+        Returns the aggregated results of the chunks.
+        """
+
+        def delete(chunk):
+            with writer or nullcontext():
+                found = self.query(
+                    query=key_query(chunk), fields="_key", limit=len(chunk)
+                )
+                found = [document["_key"] for document in found]
+                if found:
+                    self.delete(query=key_query(found))
+
+            return len(found)
+
+        return write_chunks(delete_chunks(keys), delete)
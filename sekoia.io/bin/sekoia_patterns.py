@@ -0,0 +1,602 @@
+"""
+Extraction of the comparisons of the STIX patterns of the indicators
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import antlr4
+from antlr4.atn.LexerAction import (
+    LexerMoreAction,
+    LexerPopModeAction,
+    LexerSkipAction,
+)
+from antlr4.atn.SemanticContext import SemanticContext
+from antlr4.dfa.DFA import DFA
+from antlr4.PredictionContext import PredictionContext
+from stix2patterns.exceptions import ParseException, ParserErrorListener
+from stix2patterns.v20.grammars import STIXPatternLexer as lexer_module
+from stix2patterns.v20.grammars import STIXPatternParser as parser_module
+from stix2patterns.v20.grammars.STIXPatternLexer import STIXPatternLexer
+from stix2patterns.v20.grammars.STIXPatternParser import STIXPatternParser
+from stix2patterns.v20.inspector import InspectionListener
+
+# Whitespace skipped by the STIX pattern lexer between tokens
+_WS = r"[ \t\r\n]*"
+
+# STIX string literal, where only \' and \\ are valid escapes
+_STRING = r"'(?:[^'\\]|\\['\\])*'"
+
+# Path component, either an identifier or a quoted name
+_COMPONENT = r"[A-Za-z_][A-Za-z0-9_]*|'[^'\\]*'"
+
+_START = re.compile(_WS + r"\[")
+_COMPARISON = re.compile(
+    r"{ws}(?P<type>[A-Za-z_][A-Za-z0-9_-]*){ws}:{ws}"
+    r"(?P<path>(?:{c})(?:{ws}\.{ws}(?:{c}))*){ws}={ws}(?P<value>{s})".format(
+        ws=_WS, c=_COMPONENT, s=_STRING
+    )
+)
+_PATH_COMPONENT = re.compile(_COMPONENT)
+_OR = re.compile(_WS + r"OR(?=[ \t\r\n])")
+_END = re.compile(_WS + r"\]" + _WS + r"\Z")
+
+# Default memory budget of the cache of the comparisons, in bytes
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+# Estimated memory of a cache entry, besides its strings
+_ENTRY_OVERHEAD = 512
+
+# Counters of the PatternExtractor stats, added up across processes
+PATTERN_COUNTERS = ("fast_path", "fallback", "hits", "misses", "evictions")
+
+# File of the checkpoint directory keeping the DFA of the STIX pattern parser
+DFA_CACHE_FILE = "stix_patterns.dfa"
+
+# Version of the format of the DFA cache files
+DFA_CACHE_FORMAT = 1
+
+
+def _entry_size(pattern, comparisons):
+    """
+    Estimates the memory held by the cache entry of a pattern
+    """
+    size = _ENTRY_OVERHEAD + sys.getsizeof(pattern)
+
+    for observable_type, type_comparisons in comparisons.items():
+        size += sys.getsizeof(observable_type)
+        for path, operator, value in type_comparisons:
+            size += sys.getsizeof(value) + sum(
+                sys.getsizeof(component) for component in path
+            )
+
+    return size
+
+
+class PatternCompiler(object):
+    """
+    Parses STIX patterns like stix2patterns' `Pattern`, with one lexer and
+    parser per thread which are reset onto each new pattern instead of
+    being built again.
+
+    With `two_stage`, the patterns are first parsed with the SLL prediction
+    mode, and parsed again with the full LL prediction only when it fails.
+    """
+
+    def __init__(self, two_stage=False):
+        self.two_stage = two_stage
+        self._local = threading.local()
+
+    def _get_parser(self):
+        """
+        Returns the lexer, token stream, parser and error listener of the
+        calling thread, created on its first call
+        """
+        parser_state = getattr(self._local, "parser_state", None)
+
+        if parser_state is None:
+            lexer = STIXPatternLexer(antlr4.InputStream(""))
+            lexer.removeErrorListeners()
+            token_stream = antlr4.CommonTokenStream(lexer)
+
+            parser = STIXPatternParser(token_stream)
+            parser.removeErrorListeners()
+            error_listener = ParserErrorListener()
+            parser.addErrorListener(error_listener)
+
+            # stop at the first error, like stix2patterns
+            parser._errHandler = antlr4.BailErrorStrategy()
+
+            # same error messages as stix2patterns
+            for i, literal_name in enumerate(parser.literalNames):
+                if literal_name == "<INVALID>":
+                    parser.literalNames[i] = parser.symbolicNames[i]
+
+            parser_state = (lexer, token_stream, parser, error_listener)
+            self._local.parser_state = parser_state
+
+        return parser_state
+
+    def parse(self, pattern):
+        """
+        Returns the parse tree of the pattern, raises ParseException when
+        it is invalid
+        """
+        lexer, token_stream, parser, error_listener = self._get_parser()
+
+        lexer.inputStream = antlr4.InputStream(pattern)
+        token_stream.setTokenSource(lexer)
+        parser.setTokenStream(token_stream)
+        error_listener.error_message = None
+
+        if self.two_stage:
+            # the SLL prediction bails out without reporting, on the syntax
+            # errors as well as on the decisions needing the full context:
+            # the LL prediction then parses the pattern again
+            parser._interp.predictionMode = antlr4.PredictionMode.SLL
+            try:
+                return parser.pattern()
+            except antlr4.error.Errors.ParseCancellationException:
+                parser.reset()
+
+        parser._interp.predictionMode = antlr4.PredictionMode.LL
+
+        try:
+            return parser.pattern()
+        except antlr4.error.Errors.ParseCancellationException as error:
+            # the cancellation wraps the error which made the parser bail,
+            # reported to the listener to get its message
+            parser._errHandler.reportError(parser, error.args[0])
+            raise ParseException(error_listener.error_message) from error.args[0]
+
+    def inspect(self, pattern):
+        """
+        Returns the inspection of the pattern, as `Pattern.inspect()`
+        """
+        inspector = InspectionListener()
+        antlr4.ParseTreeWalker.DEFAULT.walk(inspector, self.parse(pattern))
+
+        return inspector.pattern_data()
+
+    def inspect_many(self, patterns):
+        """
+        Returns the inspection of each pattern, raises ParseException when
+        one of them is invalid
+        """
+        return [self.inspect(pattern) for pattern in patterns]
+
+
+DEFAULT_COMPILER = PatternCompiler()
+
+
+def compile_many(patterns):
+    """
+    Returns the inspection of each pattern with the default compiler
+    """
+    return DEFAULT_COMPILER.inspect_many(patterns)
+
+
+class PatternExtractor(object):
+    """
+    Extracts the comparisons of STIX patterns, in the format of the
+    `comparisons` of stix2patterns' inspection.
+
+    Patterns made of one equality, or of equalities joined with OR, on the
+    supported types and paths are read by a regex recognizer. The other
+    patterns are parsed by a PatternCompiler, with the two-stage prediction
+    when `two_stage` is set.
+
+    The comparisons are kept in a LRU cache keyed by the pattern text, whose
+    estimated memory is bounded by `cache_size` bytes. The cached
+    comparisons are shared between the callers, which must not modify them.
+    """
+
+    def __init__(self, supported_types, cache_size=DEFAULT_CACHE_SIZE, two_stage=False):
+        self.supported_paths = {
+            observable_type: {tuple(path.split(".")) for path in paths}
+            for observable_type, paths in supported_types.items()
+        }
+        self.cache_size = cache_size
+        self.compiler = PatternCompiler(two_stage)
+        self.fast_path = 0
+        self.fallback = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._process_caches = {}
+        self._lock = threading.Lock()
+
+    def match(self, pattern):
+        """
+        Returns the comparisons of the pattern, or None when its shape isn't
+        recognized
+        """
+        start = _START.match(pattern)
+        if start is None:
+            return None
+
+        comparisons = {}
+        position = start.end()
+
+        while True:
+            comparison = _COMPARISON.match(pattern, position)
+            if comparison is None:
+                return None
+
+            observable_type = comparison.group("type")
+            path = [
+                component.strip("'")
+                for component in _PATH_COMPONENT.findall(comparison.group("path"))
+            ]
+            if tuple(path) not in self.supported_paths.get(observable_type, ()):
+                return None
+
+            comparisons.setdefault(observable_type, []).append(
+                (path, "=", comparison.group("value"))
+            )
+            position = comparison.end()
+
+            if _END.match(pattern, position):
+                return comparisons
+
+            separator = _OR.match(pattern, position)
+            if separator is None:
+                return None
+
+            position = separator.end()
+
+    def _evict(self):
+        while self._cache and self._cache_bytes > self.cache_size:
+            _, (_, size) = self._cache.popitem(last=False)
+            self._cache_bytes -= size
+            self.evictions += 1
+
+    def set_cache_size(self, cache_size):
+        """
+        Changes the memory budget of the cache, in bytes
+        """
+        with self._lock:
+            self.cache_size = cache_size
+            self._evict()
+
+    def set_two_stage(self, two_stage):
+        """
+        Turns the two-stage prediction of the parser on or off
+        """
+        self.compiler.two_stage = two_stage
+
+    def _lookup(self, pattern):
+        with self._lock:
+            entry = self._cache.get(pattern)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._cache.move_to_end(pattern)
+            self.hits += 1
+            return entry[0]
+
+    def _store(self, pattern, comparisons):
+        if self.cache_size <= 0:
+            return
+
+        size = _entry_size(pattern, comparisons)
+
+        with self._lock:
+            previous = self._cache.pop(pattern, None)
+            if previous is not None:
+                self._cache_bytes -= previous[1]
+
+            self._cache[pattern] = (comparisons, size)
+            self._cache_bytes += size
+            self._evict()
+
+    def extract_many(self, patterns):
+        """
+        Returns the comparisons of each pattern, for each observable type.
+
+        The patterns that are neither cached nor read by the fast path are
+        compiled together by stix2patterns.
+        """
+        patterns = list(patterns)
+        results = {}
+        unparsed = []
+
+        for pattern in patterns:
+            if pattern in results:
+                continue
+
+            comparisons = self._lookup(pattern)
+            if comparisons is None:
+                comparisons = self.match(pattern)
+
+                if comparisons is None:
+                    unparsed.append(pattern)
+                    results[pattern] = None
+                    continue
+
+                self.fast_path += 1
+                self._store(pattern, comparisons)
+
+            results[pattern] = comparisons
+
+        self.fallback += len(unparsed)
+        for pattern, inspection in zip(unparsed, self.compiler.inspect_many(unparsed)):
+            results[pattern] = inspection.comparisons
+            self._store(pattern, results[pattern])
+
+        return [results[pattern] for pattern in patterns]
+
+    def extract(self, pattern):
+        """
+        Returns the comparisons of the pattern, for each observable type
+        """
+        return self.extract_many([pattern])[0]
+
+    def stats(self):
+        """
+        Returns the number of patterns read by the fast path and by
+        stix2patterns, and the counters of the cache, those of the
+        conversion processes included
+        """
+        with self._lock:
+            return {
+                "fast_path": self.fast_path,
+                "fallback": self.fallback,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._cache)
+                + sum(entries for entries, _ in self._process_caches.values()),
+                "cache_bytes": self._cache_bytes
+                + sum(size for _, size in self._process_caches.values()),
+            }
+
+    def add_process_stats(self, stats):
+        """
+        Adds the counters of the patterns read by conversion processes, and
+        keeps the size of their caches, from the stats merged by
+        `merge_pattern_stats`
+        """
+        with self._lock:
+            for key in PATTERN_COUNTERS:
+                setattr(self, key, getattr(self, key) + stats[key])
+            self._process_caches.update(stats["processes"])
+
+    def forget_process_caches(self):
+        """
+        Forgets the caches of the conversion processes, once they are stopped
+        """
+        with self._lock:
+            self._process_caches.clear()
+
+
+def new_pattern_stats():
+    """
+    Returns the stats of the patterns read by conversion processes
+    """
+    stats = dict.fromkeys(PATTERN_COUNTERS, 0)
+    stats["processes"] = {}
+
+    return stats
+
+
+def merge_pattern_stats(stats, chunk_stats):
+    """
+    Adds the stats of the patterns of a chunk converted by the process
+    `chunk_stats["pid"]` to `stats`
+    """
+    for key in PATTERN_COUNTERS:
+        stats[key] += chunk_stats[key]
+    stats["processes"][chunk_stats["pid"]] = (
+        chunk_stats["entries"],
+        chunk_stats["cache_bytes"],
+    )
+
+
+def _shared_objects():
+    """
+    Returns the objects referenced by the DFA which must not be copied when
+    they are saved: the states and lexer actions of the ATN, and the
+    singletons of the antlr runtime
+    """
+    objects = {
+        ("empty-context",): PredictionContext.EMPTY,
+        ("no-semantic-context",): SemanticContext.NONE,
+        ("skip",): LexerSkipAction.INSTANCE,
+        ("more",): LexerMoreAction.INSTANCE,
+        ("pop-mode",): LexerPopModeAction.INSTANCE,
+    }
+
+    for name, recognizer in (
+        ("lexer", STIXPatternLexer),
+        ("parser", STIXPatternParser),
+    ):
+        for state in recognizer.atn.states:
+            if state is not None:
+                objects[(name, state.stateNumber)] = state
+
+    for i, action in enumerate(STIXPatternLexer.atn.lexerActions or []):
+        objects[("lexer-action", i)] = action
+
+    return objects
+
+
+def _reduce_dfa(dfa):
+    return _restore_dfa, (
+        dfa.atnStartState,
+        dfa.decision,
+        dfa.s0,
+        list(dfa.states.values()),
+        dfa.precedenceDfa,
+    )
+
+
+def _restore_dfa(atn_start_state, decision, s0, states, precedence_dfa):
+    dfa = DFA(atn_start_state, decision)
+    dfa.s0 = s0
+    dfa.precedenceDfa = precedence_dfa
+
+    # the states are hashed only once they are complete
+    for state in states:
+        state.configs.cachedHashCode = -1
+        dfa.states[state] = state
+
+    return dfa
+
+
+class _DFAPickler(pickle.Pickler):
+    def __init__(self, file):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.dispatch_table = {DFA: _reduce_dfa}
+        self._shared_ids = {id(obj): key for key, obj in _shared_objects().items()}
+
+    def persistent_id(self, obj):
+        return self._shared_ids.get(id(obj))
+
+
+class _DFAUnpickler(pickle.Unpickler):
+    def __init__(self, file):
+        super().__init__(file)
+        self._shared_objects = _shared_objects()
+
+    def persistent_load(self, pid):
+        try:
+            return self._shared_objects[tuple(pid)]
+        except KeyError:
+            raise pickle.UnpicklingError("Unknown shared object {}".format(pid))
+
+    def find_class(self, module, name):
+        # only the antlr runtime and this module are expected in the cache
+        if module == __name__ and name == "_restore_dfa":
+            return _restore_dfa
+        if module.split(".")[0] == "antlr4":
+            return super().find_class(module, name)
+
+        raise pickle.UnpicklingError("Unexpected class {}.{}".format(module, name))
+
+
+def grammar_hash():
+    """
+    Returns the hash of the grammar, runtime and format of the DFA caches
+    """
+    digest = hashlib.sha256()
+
+    for part in (
+        __name__,
+        DFA_CACHE_FORMAT,
+        sys.version_info[:2],
+        pickle.HIGHEST_PROTOCOL,
+        lexer_module.serializedATN(),
+        parser_module.serializedATN(),
+    ):
+        digest.update(str(part).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def dfa_cache_size():
+    """
+    Returns the number of states and edges of the DFA of the STIX pattern
+    lexer and parser, which grows as new patterns are parsed
+    """
+    size = 0
+
+    for dfa in STIXPatternLexer.decisionsToDFA + STIXPatternParser.decisionsToDFA:
+        for state in list(dfa.states) + [dfa.s0]:
+            size += 1
+            if state is not None and state.edges:
+                size += sum(1 for edge in state.edges if edge is not None)
+
+    return size
+
+
+def save_dfa_cache(file):
+    """
+    Saves the DFA of the STIX pattern lexer and parser, warmed by the
+    patterns parsed so far, in a binary file. It must not be called while
+    patterns are parsed.
+    """
+    pickler = _DFAPickler(file)
+    pickler.dump(grammar_hash())
+    pickler.dump((STIXPatternLexer.decisionsToDFA, STIXPatternParser.decisionsToDFA))
+
+
+def load_dfa_cache(file):
+    """
+    Restores the DFA saved by `save_dfa_cache` from a binary file, returns
+    False when it was saved for another grammar or runtime. It must be
+    called before patterns are parsed.
+    """
+    unpickler = _DFAUnpickler(file)
+    if unpickler.load() != grammar_hash():
+        return False
+
+    lexer_dfas, parser_dfas = unpickler.load()
+    if len(lexer_dfas) != len(STIXPatternLexer.decisionsToDFA) or len(
+        parser_dfas
+    ) != len(STIXPatternParser.decisionsToDFA):
+        return False
+
+    # the simulators hold these lists, they are updated in place
+    STIXPatternLexer.decisionsToDFA[:] = lexer_dfas
+    STIXPatternParser.decisionsToDFA[:] = parser_dfas
+
+    return True
+
+
+class DFACache(object):
+    """
+    Persists the DFA of the STIX pattern lexer and parser, warmed by the
+    parsed patterns, in the checkpoint directory so that a restarted
+    modular input doesn't start with cold parsers.
+    """
+
+    def __init__(self, checkpoint_dir):
+        self.path = os.path.join(checkpoint_dir, DFA_CACHE_FILE)
+        self._saved_size = None
+
+    def load(self):
+        """
+        Restores the DFA, returns whether the cache was usable
+        """
+        try:
+            with open(self.path, "rb") as f:
+                loaded = load_dfa_cache(f)
+        except Exception:
+            # missing, corrupted or incompatible cache: start with cold DFA
+            loaded = False
+
+        self._saved_size = dfa_cache_size()
+        return loaded
+
+    def save(self):
+        """
+        Saves the DFA when they grew since they were loaded or saved,
+        returns whether they were saved
+        """
+        size = dfa_cache_size()
+        if size == self._saved_size:
+            return False
+
+        directory = os.path.dirname(self.path)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                save_dfa_cache(f)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+        self._saved_size = size
+        return True
@@ -0,0 +1,91 @@
+"""
+Scheduling of the SEKOIA.IO feeds polled by the modular input
+"""
+
+import json
+import os
+import random
+import time
+
+# Default delay between two polls of a feed, in seconds
+DEFAULT_POLL_INTERVAL = 600
+
+# The delay of an idle feed grows up to this factor of its poll interval
+MAX_IDLE_BACKOFF = 4
+
+# Random spread applied to the delays, as a fraction of the delay
+JITTER = 0.1
+
+
+class FeedScheduler(object):
+    """
+    Decides when each feed is polled.
+
+    A feed with more indicators waiting (catch-up) is polled again right
+    away. A feed that returned no indicators backs off, up to
+    MAX_IDLE_BACKOFF times its poll interval, and the delays are spread
+    with a random jitter. Next run times are persisted in the checkpoint
+    directory so that a restart doesn't poll every feed at once.
+    """
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        self._schedules = {}
+
+    def _path(self, feed_id):
+        return os.path.join(self.checkpoint_dir, "{}.schedule".format(feed_id))
+
+    def _load(self, feed_id):
+        if feed_id not in self._schedules:
+            schedule = {"next_run": 0, "idle_runs": 0}
+
+            try:
+                with open(self._path(feed_id), "r") as f:
+                    schedule.update(json.load(f))
+            except (IOError, OSError, ValueError):
+                pass
+
+            self._schedules[feed_id] = schedule
+
+        return self._schedules[feed_id]
+
+    def next_run(self, feed_id, poll_interval):
+        """
+        Returns the time of the next run of the feed
+        """
+        schedule = self._load(feed_id)
+        # never wait longer than the largest delay, e.g. after the interval was reduced
+        latest = time.time() + poll_interval * MAX_IDLE_BACKOFF * (1 + JITTER)
+
+        return min(schedule["next_run"], latest)
+
+    def is_due(self, feed_id, poll_interval, now=None):
+        return self.next_run(feed_id, poll_interval) <= (now or time.time())
+
+    def reschedule(self, feed_id, poll_interval, indicators=0, drained=True):
+        """
+        Schedules the next run of the feed after a run that read
+        `indicators` indicators, and returns the delay before that run
+        """
+        schedule = self._load(feed_id)
+
+        if not drained:
+            # catch-up: more indicators are waiting
+            schedule["idle_runs"] = 0
+            delay = 0
+        else:
+            if indicators > 0:
+                schedule["idle_runs"] = 0
+            else:
+                schedule["idle_runs"] += 1
+
+            backoff = 2 ** max(schedule["idle_runs"] - 1, 0)
+            delay = poll_interval * min(backoff, MAX_IDLE_BACKOFF)
+            delay += random.uniform(-JITTER, JITTER) * delay
+
+        schedule["next_run"] = time.time() + delay
+
+        with open(self._path(feed_id), "w") as f:
+            json.dump(schedule, f)
+
+        return delay
@@ -0,0 +1,144 @@
+"""
+HTTP request handler of splunklib keeping its connections to splunkd alive
+"""
+
+import io
+import ssl
+import threading
+from collections import defaultdict
+from http import client
+
+from splunklib import __version__
+from splunklib.binding import ResponseReader, _spliturl
+
+# Number of idle keep-alive connections kept per (scheme, host, port)
+MAX_IDLE_CONNECTIONS = 8
+
+# Errors of a request sent on an idle connection that the server closed
+STALE_CONNECTION_ERRORS = (ConnectionError, client.BadStatusLine)
+
+
+class PooledHandler(object):
+    """
+    Request handler for splunklib's `client.connect` and `Service`.
+
+    Unlike `splunklib.binding.handler`, which opens a connection per request,
+    the connections are kept alive and reused, up to `max_idle` idle ones per
+    (scheme, host, port). A request sent on an idle connection that splunkd
+    closed in the meantime is sent again on a new connection.
+
+    The handler is thread-safe. The responses are read entirely before
+    their connection is reused: it suits the REST calls of the modular
+    input, not the streaming of large search results.
+    """
+
+    def __init__(
+        self, timeout=None, verify=False, context=None, max_idle=MAX_IDLE_CONNECTIONS
+    ):
+        self.timeout = timeout
+        self.max_idle = max_idle
+
+        if not verify:
+            self._context = ssl._create_unverified_context()
+        else:
+            self._context = context or ssl.create_default_context()
+
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.connections = 0
+
+    def _connect(self, scheme, host, port):
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs["timeout"] = self.timeout
+
+        if scheme == "http":
+            return client.HTTPConnection(host, port, **kwargs)
+        if scheme == "https":
+            return client.HTTPSConnection(host, port, context=self._context, **kwargs)
+
+        raise ValueError(f"unsupported scheme: {scheme}")
+
+    def _acquire(self, key):
+        """
+        Returns an idle connection, or a new one, and whether it was reused
+        """
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop(), True
+
+            self.connections += 1
+
+        return self._connect(*key), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(connection)
+                return
+
+        connection.close()
+
+    def __call__(self, url, message, **kwargs):
+        scheme, host, port, path = _spliturl(url)
+        key = (scheme, host, port)
+        body = message.get("body", "")
+        head = {
+            "Content-Length": str(len(body)),
+            "Host": host,
+            "User-Agent": f"splunk-sdk-python/{__version__}",
+            "Accept": "*/*",
+            "Connection": "Keep-Alive",
+        }
+        for name, value in message["headers"]:
+            head[name] = value
+        method = message.get("method", "GET")
+
+        while True:
+            connection, reused = self._acquire(key)
+            try:
+                connection.request(method, path, body, head)
+                response = connection.getresponse()
+                content = response.read()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+
+            break
+
+        with self._lock:
+            self.requests += 1
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+        return {
+            "status": response.status,
+            "reason": response.reason,
+            "headers": response.getheaders(),
+            "body": ResponseReader(io.BytesIO(content)),
+        }
+
+    def stats(self):
+        """
+        Returns the number of requests sent and of connections opened
+        """
+        with self._lock:
+            return {"requests": self.requests, "connections": self.connections}
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+
+            self._idle.clear()
@@ -0,0 +1,102 @@
+"""
+Benchmark of the parse cost of the STIX patterns, with the LL prediction
+only and with the two-stage SLL/LL prediction of the PatternCompiler.
+
+The corpus is a file with one pattern per line, e.g. the patterns of the
+indicators of a feed:
+
+    jq -r '.items[].pattern' pages/*.json > patterns.txt
+    python tests/benchmark_patterns.py patterns.txt
+
+Without a corpus, the STIX specification examples of stix2patterns are
+used. Each mode is measured in a new process, whose first pass over the
+corpus runs with a cold DFA.
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sekoia.io")
+
+sys.path.insert(0, os.path.join(APP_DIR, "bin"))
+sys.path.insert(0, os.path.join(APP_DIR, "lib", "py3"))
+
+SPEC_EXAMPLES = os.path.join(
+    APP_DIR, "lib", "py3", "stix2patterns", "test", "v20", "spec_examples.txt"
+)
+
+
+def read_corpus(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def parse_corpus(patterns, two_stage):
+    """
+    Returns the parse time of each pattern, in seconds, the errors included
+    """
+    from stix2patterns.exceptions import ParseException
+
+    from sekoia_patterns import PatternCompiler
+
+    compiler = PatternCompiler(two_stage)
+    durations = []
+
+    for pattern in patterns:
+        started_at = time.perf_counter()
+        try:
+            compiler.parse(pattern)
+        except ParseException:
+            pass
+        durations.append(time.perf_counter() - started_at)
+
+    return durations
+
+
+def measure(patterns, two_stage, rounds):
+    """
+    Returns the parse times of the cold pass and of the warm passes
+    """
+    cold = parse_corpus(patterns, two_stage)
+    warm = []
+    for _ in range(rounds):
+        warm.extend(parse_corpus(patterns, two_stage))
+
+    return cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", nargs="?", default=SPEC_EXAMPLES)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    patterns = read_corpus(args.corpus)
+    print("{} patterns from {}".format(len(patterns), args.corpus))
+    print(
+        "{:<10} {:>12} {:>12} {:>12}".format(
+            "mode", "cold mean", "warm mean", "warm median"
+        )
+    )
+
+    context = multiprocessing.get_context("spawn")
+    for name, two_stage in (("LL", False), ("SLL/LL", True)):
+        with context.Pool(1) as pool:
+            cold, warm = pool.apply(measure, (patterns, two_stage, args.rounds))
+
+        print(
+            "{:<10} {:>10.0f}us {:>10.0f}us {:>10.0f}us".format(
+                name,
+                statistics.mean(cold) * 1e6,
+                statistics.mean(warm) * 1e6,
+                statistics.median(warm) * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
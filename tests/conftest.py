@@ -0,0 +1,7 @@
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "sekoia.io")
+
+sys.path.insert(0, os.path.join(APP_DIR, "bin"))
+sys.path.insert(0, os.path.join(APP_DIR, "lib", "py3"))
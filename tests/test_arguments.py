@@ -0,0 +1,97 @@
+"""
+Test cases for the arguments of the modular input
+"""
+
+import pytest
+
+from sekoia_indicators import (
+    RUN_MODES,
+    SEKOIAIndicators,
+    get_argument_errors,
+    get_choice_argument,
+    get_int_argument,
+)
+
+
+class Definition(object):
+    def __init__(self, **parameters):
+        self.parameters = parameters
+
+
+class Inputs(object):
+    def __init__(self, **inputs):
+        self.inputs = inputs
+
+
+class EventWriter(object):
+    DEBUG, INFO, WARN, ERROR, FATAL = "DEBUG", "INFO", "WARN", "ERROR", "FATAL"
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, severity, message):
+        self.messages.append((severity, message))
+
+
+@pytest.mark.parametrize(
+    "value, expected", [(None, 7), ("", 7), (" ", 7), ("12", 12), ("1.5", 7), ("x", 7)]
+)
+def test_int_argument(value, expected):
+    assert get_int_argument({"feed_workers": value}, "feed_workers", 7) == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(None, "sync"), ("", "sync"), (" AsyncIO ", "asyncio"), ("threads", "sync")],
+)
+def test_choice_argument(value, expected):
+    assert get_choice_argument({"run_mode": value}, "run_mode", RUN_MODES) == expected
+
+
+def test_argument_errors():
+    errors = get_argument_errors(
+        {
+            "page_size": "100",
+            "pattern_cache_size": "32MB",
+            "kvstore_writers": "",
+            "digest_index_ttl": "7.5",
+            "run_mode": "Asyncio",
+            "feed_worker_mode": "fork",
+        }
+    )
+
+    assert errors == [
+        "pattern_cache_size must be an integer, not '32MB'",
+        "digest_index_ttl must be an integer, not '7.5'",
+        "feed_worker_mode must be one of thread, process, not 'fork'",
+    ]
+
+
+def test_invalid_arguments_rejected_before_connecting():
+    script = SEKOIAIndicators()
+    script.get_indicators = lambda **kwargs: pytest.fail("the feed was requested")
+
+    with pytest.raises(Exception, match="run_mode must be one of sync, asyncio"):
+        script.validate_input(Definition(feed_id="", api_key="key", run_mode="threads"))
+
+
+def test_invalid_arguments_logged():
+    ew = EventWriter()
+
+    SEKOIAIndicators().log_argument_errors(
+        ew,
+        Inputs(
+            **{
+                "sekoia_indicators://b": {"kvstore_writers": "four"},
+                "sekoia_indicators://a": {"kvstore_writers": "4"},
+            }
+        ),
+    )
+
+    assert ew.messages == [
+        (
+            "ERROR",
+            "Input sekoia_indicators://b: kvstore_writers must be an integer, "
+            "not 'four', the default value is used instead",
+        )
+    ]
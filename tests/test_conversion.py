@@ -0,0 +1,313 @@
+"""
+Test cases for the conversion of the indicators to KV-Store documents
+"""
+
+from __future__ import print_function
+
+import itertools
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+import six
+import stix2patterns
+from stix2patterns.exceptions import ParseException
+from stix2patterns.pattern import Pattern
+
+from sekoia_indicators import SEKOIAIndicators, rfc3339_to_timestamp
+
+SUPPORTED_TYPES = {
+    "ipv4-addr": {"value": "ipv4"},
+    "domain-name": {"value": "domain"},
+    "url": {"value": "url"},
+    "file": {"hashes.MD5": "md5", "hashes.SHA-1": "sha1", "hashes.SHA-256": "sha256"},
+}
+
+SPEC_CASES_FILE = os.path.join(
+    os.path.dirname(stix2patterns.__file__), "test", "v20", "spec_examples.txt"
+)
+
+PATTERNS = [
+    "[ipv4-addr:value = '1.2.3.4']",
+    "[domain-name:value = 'Evil.Example.COM']",
+    "[url:value = 'http://a/b?c=d']",
+    "[url:value = 'it\\'s \\\\ ok']",
+    "[url:value = 'é ']",
+    "[url:value = '']",
+    "[url:value = '{}']".format("a" * 1024),
+    "[url:value = '{}']".format("a" * 1025),
+    "[file:hashes.MD5 = 'D41D8CD98F00B204E9800998ECF8427E']",
+    "[file:hashes.'SHA-1' = 'da39a3ee']",
+    "[file:hashes.'SHA-256' = 'e3b0' OR file:hashes.MD5 = 'b']",
+    "[url:value = 'a' OR ipv4-addr:value = 'b' OR url:value = 'c']",
+    "[url:value = 'a' AND domain-name:value = 'b']",
+    "[url:value = 'a'] OR [domain-name:value = 'b']",
+    "[url:value != 'a']",
+    "[url:value LIKE 'a%']",
+    "[file:name = 'a' OR file:hashes.MD5 = 'b']",
+    "[file:hashes[*] = 'a']",
+    "[x-foo:value = 'a' OR url:value = 'b']",
+    "[network-traffic:dst_ref.value = '1']",
+]
+
+VALID_UNTIL = [
+    None,
+    "",
+    "2099-01-01T00:00:00Z",
+    "2099-06-15T12:34:56.789Z",
+    "2001-01-01T00:00:00Z",
+    "not a date",
+]
+
+API_ROOT_URLS = [None, "https://api.sekoia.io", "https://app.sekoia.io/api/"]
+
+
+def from_rfc3339(date_string):
+    try:
+        return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%SZ")
+
+
+# Convert a STIX 2.1 Indicator to Splunk key-value objects, as in 1.4.0
+def indicator_to_kv(indicator, api_root_url):
+    results = defaultdict(list)
+    pattern_type = indicator.get("pattern_type")
+
+    if pattern_type is not None and pattern_type != "stix":
+        print(
+            "WARNING Unsupported pattern type '{}'".format(pattern_type),
+            file=sys.stderr,
+        )
+        return results
+
+    parsed_pattern = Pattern(indicator["pattern"])
+
+    for observable_type, comparisons in six.iteritems(
+        parsed_pattern.inspect().comparisons
+    ):
+        for path, operator, value in comparisons:
+            if observable_type not in SUPPORTED_TYPES:
+                print(
+                    "WARNING Unsupported type '{}' in pattern '{}'".format(
+                        observable_type, indicator["pattern"]
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+
+            try:
+                path = ".".join(path)
+            except TypeError:
+                # This happends when the pattern contains '*', which is unsupported by the Splunk App
+                print(
+                    "WARNING Unsupported path '*' in pattern '{}'".format(
+                        indicator["pattern"]
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+
+            if path not in SUPPORTED_TYPES[observable_type]:
+                print(
+                    "WARNING Unsupported path '{}' in pattern '{}'".format(
+                        path, indicator["pattern"]
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+
+            if operator != "=":
+                print(
+                    "WARNING Unsupported operator '{}' in pattern '{}'".format(
+                        operator, indicator["pattern"]
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+
+            # KV store that hosts the IOC leverage
+            # an accelerated field to support fast enrichment.
+            #
+            # Unfortunately, Splunk Accelerated Fields
+            # cannot be larger than 1024.
+            if len(value.strip("'")) <= 1024:
+
+                if not api_root_url:
+                    server_root_url = "https://app.sekoia.io"
+                else:
+                    server_root_url = api_root_url
+                    if server_root_url.endswith("/api"):
+                        server_root_url = server_root_url[:-4]
+                    elif server_root_url.endswith("/api/"):
+                        server_root_url = server_root_url[:-5]
+
+                # Applying _key to lowercase to avoid case sensitivity
+                result = {
+                    "_key": value.strip("'").lower(),
+                    "indicator_id": indicator["id"],
+                    "server_root_url": server_root_url,
+                    "valid_until": indicator.get("valid_until"),
+                }
+
+                if indicator.get("valid_until"):
+                    try:
+                        result["valid_until"] = int(
+                            time.mktime(
+                                datetime.strptime(
+                                    indicator["valid_until"][:19], "%Y-%m-%dT%H:%M:%S"
+                                ).timetuple()
+                            )
+                        )
+
+                    except ValueError:
+                        print(
+                            "WARNING Incorrect `valid_until` '{}' in pattern '{}'".format(
+                                indicator["valid_until"], indicator["pattern"]
+                            ),
+                            file=sys.stderr,
+                        )
+                        continue
+
+                results[SUPPORTED_TYPES[observable_type][path]].append(result)
+
+    return results
+
+
+def baseline_conversion(indicators, api_root_url):
+    """
+    Returns the documents saved and revoked by the store_indicators of the
+    1.4.0 release
+    """
+    objects = defaultdict(list)
+    revoked = defaultdict(list)
+    now = datetime.utcnow()
+
+    for indicator in indicators:
+        kv_objects = indicator_to_kv(indicator, api_root_url)
+
+        if indicator.get("revoked", False):
+            for ioc_type, dicts in six.iteritems(kv_objects):
+                revoked[ioc_type] += dicts
+        # Only import IOCs with a Valid Until date set
+        elif indicator.get("valid_until"):
+            try:
+                valid_until = from_rfc3339(indicator["valid_until"])
+            except ValueError:
+                continue
+
+            # Ignore expired indicators
+            if valid_until > now:
+                for ioc_type, dicts in six.iteritems(kv_objects):
+                    objects[ioc_type] += dicts
+
+    return objects, revoked
+
+
+def read_patterns():
+    with open(SPEC_CASES_FILE) as f:
+        patterns = [line.strip() for line in f if line.strip()] + PATTERNS
+
+    valid = []
+    for pattern in patterns:
+        try:
+            Pattern(pattern)
+        except ParseException:
+            continue
+        valid.append(pattern)
+
+    return valid
+
+
+def indicators():
+    cases = itertools.product(
+        read_patterns(), VALID_UNTIL, (False, True), (None, "stix", "sigma")
+    )
+
+    return [
+        {
+            "id": "indicator--{}".format(number),
+            "pattern": pattern,
+            "pattern_type": pattern_type,
+            "valid_until": valid_until,
+            "revoked": revoked,
+        }
+        for number, (pattern, valid_until, revoked, pattern_type) in enumerate(cases)
+    ]
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def as_dicts(documents):
+    return {
+        ioc_type: [record.to_dict() for record in records]
+        for ioc_type, records in six.iteritems(documents)
+        if records
+    }
+
+
+@pytest.mark.parametrize("api_root_url", API_ROOT_URLS)
+def test_same_documents_as_the_baseline(utc, api_root_url):
+    page = indicators()
+
+    objects, revoked, _ = SEKOIAIndicators().indicators_to_kv(page, api_root_url)
+    baseline_objects, baseline_revoked = baseline_conversion(page, api_root_url)
+
+    assert baseline_objects and baseline_revoked
+    assert as_dicts(objects) == dict(baseline_objects)
+    assert as_dicts(revoked) == dict(baseline_revoked)
+
+
+@pytest.mark.parametrize(
+    "date_string, timestamp",
+    [
+        ("1970-01-01T00:00:00Z", 0),
+        ("2024-02-29T12:34:56Z", 1709210096),
+        ("2024-02-29T12:34:56z", 1709210096),
+        ("2024-02-29t12:34:56Z", 1709210096),
+        ("2024-02-29T12:34:56.1Z", 1709210096),
+        ("2024-02-29T12:34:56.999999999Z", 1709210096),
+        ("2024-02-29T12:34:56+00:00", 1709210096),
+        ("2024-02-29T14:34:56+02:00", 1709210096),
+        ("2024-02-29T07:04:56-05:30", 1709210096),
+        ("2024-03-01T00:04:56.5+11:30", 1709210096),
+        ("1969-12-31T23:59:59Z", -1),
+    ],
+)
+def test_rfc3339_to_timestamp(date_string, timestamp):
+    assert rfc3339_to_timestamp(date_string) == timestamp
+
+
+@pytest.mark.parametrize(
+    "date_string",
+    [
+        "",
+        "2024-02-29",
+        "2024-02-29 12:34:56Z",
+        "2024-02-29T12:34:56",
+        "2024-02-29T12:34Z",
+        "2024-02-29T12:34:56.Z",
+        "2024-02-29T12:34:56+0200",
+        "2024-02-29T12:34:56+02",
+        "2024-02-29T12:34:56Z ",
+        "2023-02-29T12:34:56Z",
+        "2024-13-01T00:00:00Z",
+        "2024-04-31T00:00:00Z",
+        "2024-01-01T24:00:00Z",
+        "2024-01-01T00:60:00Z",
+        "2016-12-31T23:59:60Z",
+        "not a date",
+    ],
+)
+def test_rfc3339_to_timestamp_invalid(date_string):
+    assert rfc3339_to_timestamp(date_string) is None
@@ -0,0 +1,322 @@
+"""
+Test cases for the HTTP sessions of the feeds
+"""
+
+import json
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from sekoia_diagnostics import ConversionDiagnostics
+from sekoia_feed import (
+    FeedPage,
+    FeedSession,
+    JSONItemsStream,
+    PageSizer,
+    RateLimiter,
+)
+from sekoia_indicators import SEKOIAIndicators
+
+TRANSFER = {"wire_bytes": 0, "decoded_bytes": 0, "elapsed": 0.01}
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = json.dumps({"items": [], "next_cursor": None}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def proxy():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ProxyHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_proxy_url_over_environment(proxy, monkeypatch):
+    # nothing listens on the proxy of the environment
+    monkeypatch.setenv("HTTP_PROXY", "http://127.0.0.1:9")
+    monkeypatch.setenv("HTTPS_PROXY", "http://127.0.0.1:9")
+    session = FeedSession(
+        "feed",
+        "key",
+        proxy_url="http://127.0.0.1:{}".format(proxy.server_port),
+        max_retries=0,
+    )
+
+    page = session.get_page("http://feed.example/v2/inthreat/collections/feed")
+
+    assert page.items == []
+    assert proxy.paths == ["http://feed.example/v2/inthreat/collections/feed"]
+    session.close()
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """
+    Answers with the scripted Retry-After delays of the server, then a page
+    """
+
+    def do_GET(self):
+        if self.server.retry_after:
+            self.server.paths.append(self.path)
+            self.send_response(429)
+            self.send_header("Retry-After", self.server.retry_after.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        ProxyHandler.do_GET(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingHandler)
+    server.paths = []
+    server.retry_after = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_throttled_request_retried(api):
+    api.retry_after = ["0", "0"]
+    session = FeedSession("feed", "key")
+
+    page = session.get_page("http://127.0.0.1:{}/feed".format(api.server_port))
+
+    assert page.items == []
+    assert (len(api.paths), session.retries) == (3, 2)
+    session.close()
+
+
+@pytest.mark.parametrize(
+    "max_retries, max_retry_time, retry_after", [(0, 600, "0"), (5, 1, "120")]
+)
+def test_throttled_request_not_retried(api, max_retries, max_retry_time, retry_after):
+    api.retry_after = [retry_after]
+    session = FeedSession(
+        "feed", "key", max_retries=max_retries, max_retry_time=max_retry_time
+    )
+    started_at = time.monotonic()
+
+    with pytest.raises(requests.exceptions.HTTPError, match="429"):
+        session.get_page("http://127.0.0.1:{}/feed".format(api.server_port))
+
+    assert (len(api.paths), session.retries) == (1, 0)
+    assert time.monotonic() - started_at < 1
+    session.close()
+
+
+def chunked(data, size):
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+def read_stream(chunks):
+    stream = JSONItemsStream(chunks, key="items")
+    items = list(stream)
+    return items, stream.envelope
+
+
+PAGE = {
+    "next_cursor": "Y3Vyc29y",
+    "items": [
+        {"id": "indicator--1", "pattern": "[domain-name:value = 'évil.example']"},
+        {"id": "indicator--2", "score": 12345, "ratio": -1.5e-3, "tags": []},
+        {"id": "indicator--3", "revoked": True, "valid_until": None},
+        '\u00e9" \\ ⚠ 😈',
+        67890,
+    ],
+    "total": 5,
+}
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 100000])
+def test_json_stream_chunk_boundaries(size):
+    # the multibyte characters and the numbers are cut at every position
+    data = json.dumps(PAGE, ensure_ascii=False, indent=1).encode("utf-8")
+
+    items, envelope = read_stream(chunked(data, size))
+
+    assert items == PAGE["items"]
+    assert envelope == {"next_cursor": "Y3Vyc29y", "total": 5}
+
+
+@pytest.mark.parametrize(
+    "data, items, envelope",
+    [
+        (b'{"next_cursor": "c", "items": [1, 2]}', [1, 2], {"next_cursor": "c"}),
+        (b'{"items": [1, 2], "next_cursor": null}', [1, 2], {"next_cursor": None}),
+        (b'{"items": [], "next_cursor": "c"}', [], {"next_cursor": "c"}),
+        (b" { } ", [], {}),
+    ],
+)
+def test_json_stream_envelope(data, items, envelope):
+    assert read_stream(chunked(data, 1)) == (items, envelope)
+
+
+def test_json_stream_number_at_the_end_of_a_chunk():
+    # 12 then 345 would be read as two numbers without waiting for a delimiter
+    items, _ = read_stream([b'{"items": [12', b"345, 6", b"7]}"])
+
+    assert items == [12345, 67]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'{"items": [{"id": "indicator--1"}, {"id": "indic',
+        b'{"items": [{"id": "indicator--1"}',
+        b'{"items": [1, 2',
+        b'{"next_cursor": "c"',
+        b'{"items": [1]',
+        b"",
+    ],
+)
+def test_json_stream_truncated(data):
+    with pytest.raises(ValueError):
+        read_stream(chunked(data, 3))
+
+
+def test_json_stream_truncated_multibyte_character():
+    data = '{"items": ["é"]}'.encode("utf-8")
+    # the stream ends in the middle of the two bytes of é
+    with pytest.raises(ValueError):
+        read_stream([data[:13]])
+
+
+def acquire_tokens(rate_limiter, count, times):
+    for _ in range(count):
+        rate_limiter.acquire()
+        times.put(time.monotonic())
+
+
+def test_rate_limiter_shared_by_processes():
+    context = multiprocessing.get_context("spawn")
+    rate_limiter = RateLimiter(20, context=context)
+    times = context.Queue()
+    processes = [
+        context.Process(target=acquire_tokens, args=(rate_limiter, 15, times))
+        for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+
+    acquired = sorted(times.get(timeout=30) for _ in range(45))
+    for process in processes:
+        process.join()
+
+    # 20 tokens at once, then 20 per second
+    assert acquired[-1] - acquired[0] >= (45 - 20) / 20 * 0.95
+
+
+class ScriptedSession(object):
+    """
+    Feed session answering the page requests with scripted pages
+    """
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.urls = []
+
+    def get_page(self, url):
+        self.urls.append(url)
+        return self.pages.pop(0)
+
+    def stats(self):
+        keys = ("requests", "retries", "connections", "reused", "wire_bytes")
+        return dict.fromkeys(keys + ("decoded_bytes",), 0)
+
+
+def test_feed_read_past_short_pages():
+    session = ScriptedSession(
+        FeedPage([{"id": "a"}], "c1", TRANSFER),
+        FeedPage([{"id": "b"}, {"id": "c"}], "c2", TRANSFER),
+        FeedPage([], "c3", TRANSFER),
+    )
+
+    pages = list(
+        SEKOIAIndicators().get_indicators(
+            feed_id="feed", api_key="key", session=session, page_sizer=PageSizer(100)
+        )
+    )
+
+    assert [page.size for page in pages] == [1, 2, 0]
+    assert session.urls[1].endswith("&limit=100&cursor=c1")
+    assert session.urls[2].endswith("&limit=100&cursor=c2")
+
+
+def test_feed_ends_without_cursor():
+    session = ScriptedSession(FeedPage([{"id": "a"}], None, TRANSFER))
+
+    pages = list(
+        SEKOIAIndicators().get_indicators(
+            feed_id="feed", api_key="key", session=session, page_sizer=PageSizer(100)
+        )
+    )
+
+    assert [page.size for page in pages] == [1]
+
+
+class EventWriter(object):
+    DEBUG, INFO, WARN, ERROR, FATAL = "DEBUG", "INFO", "WARN", "ERROR", "FATAL"
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, severity, message):
+        self.messages.append((severity, message))
+
+
+class Inputs(object):
+    def __init__(self, **arguments):
+        self.inputs = {"sekoia_indicators://feed": arguments}
+
+
+@pytest.mark.parametrize(
+    "next_cursor, drained", [(None, True), ("c1", False)], ids=["last", "more"]
+)
+def test_feed_drained_on_the_max_pages_page(monkeypatch, next_cursor, drained):
+    script = SEKOIAIndicators()
+    session = ScriptedSession(FeedPage([{"id": "a"}], next_cursor, TRANSFER))
+    monkeypatch.setattr(script, "_get_api_key_from_secured_storage", lambda **_: "key")
+    monkeypatch.setattr(script, "get_cursor", lambda inputs, feed_id: None)
+    monkeypatch.setattr(script, "store_cursor", lambda inputs, feed_id, cursor: None)
+    monkeypatch.setattr(script, "get_feed_session", lambda *args: session)
+    monkeypatch.setattr(
+        script, "store_indicators", lambda *args: ConversionDiagnostics()
+    )
+    input_item = {"max_pages_per_run": "1", "prefetch_pages": "0"}
+
+    ew = EventWriter()
+
+    result = script.ingest_feed(
+        Inputs(**input_item), "sekoia_indicators://feed", input_item, ew
+    )
+
+    assert result == {"indicators": 1, "drained": drained}
+    assert [message for message in ew.messages if message[0] == "ERROR"] == []
@@ -0,0 +1,211 @@
+"""
+Test cases for the requests of the IOC KV-Store collections
+"""
+
+import io
+import json
+from urllib.parse import quote
+
+import pytest
+from splunklib.binding import HTTPError
+
+from sekoia_kvstore import (
+    IOCCollectionData,
+    IOCRecord,
+    dumps_record_chunks,
+    dumps_records,
+    key_chunks,
+)
+
+SERVER_ROOT_URL = "https://app.sekoia.io"
+
+
+def records(count, key="key-{}"):
+    return [
+        IOCRecord(key.format(i), "indicator--{}".format(i), SERVER_ROOT_URL, 4102444800)
+        for i in range(count)
+    ]
+
+
+def assert_chunks(chunks, records):
+    """
+    Checks that the chunks hold the records, in order, and that their JSON
+    is the one of their records
+    """
+    assert [record for chunk, _ in chunks for record in chunk] == records
+    for chunk, body in chunks:
+        assert json.loads(body) == [record.to_dict() for record in chunk]
+
+
+def test_record_chunks_count_limit():
+    saved = records(10)
+
+    chunks = list(dumps_record_chunks(saved, 3, 1024 * 1024))
+
+    assert [len(chunk) for chunk, _ in chunks] == [3, 3, 3, 1]
+    assert_chunks(chunks, saved)
+
+
+@pytest.mark.parametrize("margin, sizes", [(0, [2, 2, 1]), (-1, [1, 1, 1, 1, 1])])
+def test_record_chunks_byte_limit(margin, sizes):
+    saved = records(5)
+    max_bytes = len(dumps_records(saved[:2])) + margin
+
+    chunks = list(dumps_record_chunks(saved, 100, max_bytes))
+
+    assert [len(chunk) for chunk, _ in chunks] == sizes
+    assert all(len(body.encode("utf-8")) <= max_bytes for _, body in chunks)
+    assert_chunks(chunks, saved)
+
+
+def test_record_chunks_non_ascii_keys():
+    saved = records(6, key="é-{}-☃")
+    max_bytes = 300
+
+    chunks = list(dumps_record_chunks(saved, 100, max_bytes))
+
+    # the JSON is escaped to ASCII, its length is its size in bytes
+    assert all(body.isascii() for _, body in chunks)
+    assert all(len(body) <= max_bytes for _, body in chunks)
+    assert len(chunks) > 1
+    assert_chunks(chunks, saved)
+
+
+def test_record_chunks_oversized_document():
+    saved = records(2) + records(1, key="x" * 2000) + records(2)
+
+    chunks = list(dumps_record_chunks(saved, 100, 500))
+
+    assert [len(chunk) for chunk, _ in chunks] == [2, 1, 2]
+    assert chunks[1][0] == [saved[2]]
+    assert len(chunks[1][1]) > 500
+    assert_chunks(chunks, saved)
+
+
+def test_record_chunks_without_records():
+    assert list(dumps_record_chunks([], 100, 1024)) == []
+
+
+def query_size(chunk):
+    # the size of the keys in the url-encoded query, as counted by key_chunks
+    return sum(len(quote(json.dumps({"_key": key}))) + 3 for key in chunk)
+
+
+def test_key_chunks_count_limit():
+    keys = ["key-{}".format(i) for i in range(250)]
+
+    chunks = list(key_chunks(keys + keys[:10], max_keys=100))
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert [key for chunk in chunks for key in chunk] == keys
+
+
+def test_key_chunks_byte_limit():
+    # é is escaped to \u00e9 in the JSON of the query, then url-encoded on 8 bytes
+    keys = ["é" * 20 + str(i) for i in range(20)]
+
+    chunks = list(key_chunks(keys, max_keys=100, max_bytes=1000))
+
+    assert len(chunks) > 1
+    assert all(query_size(chunk) <= 1000 for chunk in chunks)
+    # no chunk could take the first key of the next one
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert query_size(chunk + following[:1]) > 1000
+    assert [key for chunk in chunks for key in chunk] == keys
+
+
+def test_key_chunks_oversized_key():
+    keys = ["a", "x" * 5000, "b"]
+
+    assert list(key_chunks(keys, max_bytes=100)) == [["a"], ["x" * 5000], ["b"]]
+
+
+class Response(object):
+    def __init__(self, body, status=200, reason="OK"):
+        self.status = status
+        self.reason = reason
+        self.headers = []
+        self.body = io.BytesIO(body)
+
+
+class Service(object):
+    """
+    splunkd service holding the keys of one KV-Store collection
+    """
+
+    def __init__(self, keys, failing=()):
+        self.keys = set(keys)
+        self.failing = set(failing)
+        self.requests = []
+
+    def get(self, path, query, fields, limit, **kwargs):
+        keys = [item["_key"] for item in json.loads(query)["$or"]]
+        self.requests.append(("GET", keys))
+        assert (fields, limit) == ("_key", len(keys))
+
+        if self.failing.intersection(keys):
+            raise HTTPError(Response(b"KV Store is unavailable", 503, "Unavailable"))
+
+        found = [{"_key": key} for key in keys if key in self.keys]
+        return Response(json.dumps(found).encode())
+
+    def delete(self, path, query, **kwargs):
+        keys = [item["_key"] for item in json.loads(query)["$or"]]
+        self.requests.append(("DELETE", keys))
+        self.keys.difference_update(keys)
+
+        return Response(b"")
+
+
+class Collection(object):
+    name = "sekoia_iocs_domain"
+
+    def __init__(self, service):
+        self.service = service
+
+    def _proper_namespace(self):
+        return "nobody", "sekoia.io", "app"
+
+
+def test_delete_keys_found_and_missing():
+    service = Service(["a", "c", "z"])
+    data = IOCCollectionData(Collection(service))
+
+    result = data.delete_keys(["a", "b", "c", "d", "a"])
+
+    assert result == {
+        "chunks": 1,
+        "deleted": 2,
+        "missing": 2,
+        "failed": 0,
+        "errors": [],
+    }
+    assert service.requests == [("GET", ["a", "b", "c", "d"]), ("DELETE", ["a", "c"])]
+    assert service.keys == {"z"}
+
+
+def test_delete_keys_none_found():
+    service = Service([])
+
+    result = IOCCollectionData(Collection(service)).delete_keys(["a", "b"])
+
+    assert (result["deleted"], result["missing"]) == (0, 2)
+    # nothing to delete, no DELETE request
+    assert service.requests == [("GET", ["a", "b"])]
+
+
+def test_delete_keys_failed_chunk():
+    keys = ["key-{}".format(i) for i in range(150)]
+    service = Service(keys[:10] + keys[140:], failing=["key-120"])
+
+    result = IOCCollectionData(Collection(service)).delete_keys(keys)
+
+    # the second chunk failed, the first one is still deleted
+    assert {key: value for key, value in result.items() if key != "errors"} == {
+        "chunks": 2,
+        "deleted": 10,
+        "missing": 90,
+        "failed": 50,
+    }
+    assert [error.status for error in result["errors"]] == [503]
+    assert service.keys == set(keys[140:])
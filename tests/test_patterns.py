@@ -0,0 +1,347 @@
+"""
+Test cases for the extraction of the comparisons of the STIX patterns
+"""
+
+import io
+import os
+import pickle
+import random
+import threading
+
+import pytest
+import stix2patterns
+from stix2patterns.exceptions import ParseException
+from stix2patterns.pattern import Pattern
+
+from sekoia_indicators import SUPPORTED_TYPES
+from sekoia_patterns import (
+    DFACache,
+    PatternCompiler,
+    PatternExtractor,
+    compile_many,
+    dfa_cache_size,
+    grammar_hash,
+    load_dfa_cache,
+    save_dfa_cache,
+)
+
+SPEC_CASES_FILE = os.path.join(
+    os.path.dirname(stix2patterns.__file__), "test", "v20", "spec_examples.txt"
+)
+with open(SPEC_CASES_FILE) as f:
+    SPEC_CASES = [line.strip() for line in f if line.strip()]
+
+# Patterns read by the fast path
+FAST_PATH_CASES = [
+    "[ipv4-addr:value = '1.2.3.4']",
+    "[domain-name:value = 'example.com']",
+    "[url:value = 'http://a/b?c=d']",
+    "[file:hashes.MD5 = 'd41d8cd98f00b204e9800998ecf8427e']",
+    "[file:hashes.'SHA-1' = 'da39a3ee']",
+    "[file:hashes.'SHA-256' = 'e3b0']",
+    "[file:hashes.'MD5' = 'a']",
+    "[file:'hashes'.'MD5' = 'a']",
+    "[file:hashes . MD5 = 'a']",
+    "[ ipv4-addr : value = '1' ]",
+    " \t[url:value='a']\n",
+    "[url:value = 'it\\'s \\\\ ok']",
+    "[url:value = '']",
+    "[url:value = 'é ']",
+    "[url:value = 'a\nb']",
+    "[url:value = 'a\\\\']",
+    "[url:value = 'a' OR url:value = 'b']",
+    "[url:value = 'a'OR url:value = 'b']",
+    "[url:value = 'a' OR ipv4-addr:value = 'b' OR url:value = 'c']",
+    "[file:hashes.'SHA-256' = 'a' OR file:hashes.MD5 = 'b' OR domain-name:value = 'c']",
+    "[ipv4-addr:value = '10.0.0.0/8']",
+]
+
+# Patterns left to stix2patterns: other shapes, or invalid patterns
+FALLBACK_CASES = [
+    "[url:value = 'a' or url:value = 'b']",
+    "[url:value = 'a' AND url:value = 'b']",
+    "[url:value = 'a'] OR [url:value = 'b']",
+    "[url:value != 'a']",
+    "[url:value == 'a']",
+    "[url:value LIKE 'a%']",
+    "[url:value = 'a\\n']",
+    "[file:hashes.SHA-1 = 'a']",
+    "[file:hashes.'hashes.MD5' = 'a']",
+    "[file:'hashes.MD5' = 'a']",
+    "[file:hashes.md5 = 'a']",
+    "[x-foo:value = 'a']",
+    "[file:name = 'a']",
+    "[url:value = 'a'/*c*/]",
+    "[url:value = 'a'] WITHIN 5 SECONDS",
+    "[url:value IN ('a', 'b')]",
+    "[url:value = 1]",
+    "[url:value = 'a'",
+    "[url:value = 'a' OR]",
+    "[url:value = 'a']]",
+    "url:value = 'a'",
+    "[url:value = 'a' ORurl:value = 'b']",
+    "[network-traffic:dst_ref.value = '1']",
+    "[file:hashes[*] = 'a']",
+    "[url:value = 'a' OR url:value = 'b' AND url:value = 'c']",
+    "[URL:value = 'a']",
+    "[url:VALUE = 'a']",
+    "[url:value = 'a\\']",
+]
+
+# Fragments inserted in the fuzzed patterns
+FUZZ_ATOMS = [
+    "[", "]", " ", "\t", "\n", "url", "ipv4-addr", "domain-name", "file", ":",
+    "value", "hashes", ".", "MD5", "'SHA-1'", "'SHA-256'", "'MD5'", "=", "!=",
+    "OR", "or", "AND", "'a'", "'b\\''", "'\\\\'", "'x y'", "'", "\\", "''",
+    "/*c*/", "'hashes'", "SHA-1", "1",
+]  # fmt: skip
+
+FUZZ_CASES = 3000
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return PatternExtractor(SUPPORTED_TYPES)
+
+
+def reference_comparisons(pattern):
+    """
+    Returns the comparisons of the pattern read by stix2patterns,
+    None when it is invalid
+    """
+    try:
+        return Pattern(pattern).inspect().comparisons
+    except ParseException:
+        return None
+
+
+def assert_equivalent(extractor, pattern):
+    comparisons = extractor.match(pattern)
+
+    assert comparisons is None or comparisons == reference_comparisons(pattern)
+
+    return comparisons
+
+
+@pytest.mark.parametrize("pattern", FAST_PATH_CASES)
+def test_fast_path(extractor, pattern):
+    assert assert_equivalent(extractor, pattern) is not None
+
+
+@pytest.mark.parametrize("pattern", FALLBACK_CASES)
+def test_fallback(extractor, pattern):
+    assert assert_equivalent(extractor, pattern) is None
+
+
+def fuzzed_pattern(rng):
+    """
+    Returns equalities on the supported paths joined with OR, with random
+    whitespace and quoting, and a few random edits
+    """
+    comparisons = []
+
+    for _ in range(rng.randint(1, 4)):
+        observable_type = rng.choice(sorted(SUPPORTED_TYPES))
+        components = [
+            (
+                "'{}'".format(component)
+                if "-" in component or rng.random() < 0.5
+                else component
+            )
+            for component in rng.choice(sorted(SUPPORTED_TYPES[observable_type])).split(
+                "."
+            )
+        ]
+
+        def ws():
+            return rng.choice(["", " ", "  ", "\n"])
+
+        comparisons.append(
+            observable_type
+            + ws()
+            + ":"
+            + ws()
+            + (ws() + "." + ws()).join(components)
+            + ws()
+            + "="
+            + ws()
+            + rng.choice(["'a'", "'b\\''", "''", "'c\\\\'"])
+        )
+
+    pattern = list("[" + rng.choice([" OR ", "OR ", " OR\n"]).join(comparisons) + "]")
+
+    for _ in range(rng.choice([0, 0, 1, 2])):
+        position = rng.randrange(len(pattern))
+        edit = rng.random()
+        if edit < 0.4:
+            del pattern[position]
+        elif edit < 0.8:
+            pattern.insert(position, rng.choice(FUZZ_ATOMS))
+        else:
+            pattern[position] = rng.choice(FUZZ_ATOMS)
+
+    return "".join(pattern)
+
+
+def test_fuzzed_patterns(extractor):
+    rng = random.Random(0)
+    fast_path = 0
+
+    for _ in range(FUZZ_CASES):
+        pattern = fuzzed_pattern(rng)
+        if assert_equivalent(extractor, pattern) is not None:
+            fast_path += 1
+
+    # both the fast path and the fallback are exercised
+    assert 0 < fast_path < FUZZ_CASES
+
+
+def test_extract_many(extractor):
+    patterns = FAST_PATH_CASES + [
+        pattern
+        for pattern in FALLBACK_CASES
+        if reference_comparisons(pattern) is not None
+    ]
+
+    assert extractor.extract_many(patterns) == [
+        reference_comparisons(pattern) for pattern in patterns
+    ]
+
+
+def test_compile_many():
+    assert compile_many(SPEC_CASES) == [
+        Pattern(pattern).inspect() for pattern in SPEC_CASES
+    ]
+
+
+def test_parse_trees_outlive_reuse():
+    compiler = PatternCompiler()
+    tree = compiler.parse("[foo:bar = 1]")
+    compiler.parse("[baz:quux = 'abc' AND baz:frob > 2]")
+
+    assert tree.getText() == "[foo:bar=1]<EOF>"
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "[foo:bar = ]",
+        "foo:bar = 1",
+        "[foo:bar = 1] WITHIN",
+        "[file:hashes.MD5 = cead3f77f6cda6ec00f57d76c9a6879f]",
+    ],
+)
+def test_parse_error_after_reuse(pattern):
+    compiler = PatternCompiler()
+    compiler.inspect("[foo:bar = 1]")
+
+    with pytest.raises(ParseException) as reused_error:
+        compiler.inspect(pattern)
+    with pytest.raises(ParseException) as stix2patterns_error:
+        Pattern(pattern)
+
+    assert str(reused_error.value) == str(stix2patterns_error.value)
+    # the compiler is still usable after the error
+    assert compiler.inspect("[foo:bar = 2]").comparisons == {
+        "foo": [(["bar"], "=", "2")]
+    }
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    SPEC_CASES
+    + [
+        "[foo:bar = ]",
+        "[foo:bar = 1] AND",
+        "([foo:bar = 1] OR [foo:baz = 2]",
+        "[foo:bar = 1 AND (foo:baz = 2 OR foo:quux = 3)] REPEATS 2 TIMES",
+    ],
+)
+def test_two_stage_prediction(pattern):
+    results = []
+
+    for compiler in (PatternCompiler(two_stage=True), PatternCompiler()):
+        try:
+            results.append(compiler.inspect(pattern))
+        except ParseException as error:
+            results.append(str(error))
+
+    assert results[0] == results[1]
+
+
+def test_compile_many_error():
+    with pytest.raises(ParseException):
+        compile_many(["[foo:bar = 1]", "[foo:bar = ]", "[foo:bar = 2]"])
+
+
+def test_compile_many_threads():
+    compiler = PatternCompiler()
+    expected = [Pattern(pattern).inspect() for pattern in SPEC_CASES]
+    results = {}
+
+    def inspect_specs(thread_id):
+        results[thread_id] = compiler.inspect_many(SPEC_CASES)
+
+    threads = [threading.Thread(target=inspect_specs, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    for inspections in results.values():
+        assert inspections == expected
+
+
+def test_dfa_cache_round_trip():
+    expected = compile_many(SPEC_CASES)
+    size = dfa_cache_size()
+
+    buffer = io.BytesIO()
+    save_dfa_cache(buffer)
+    buffer.seek(0)
+
+    assert load_dfa_cache(buffer)
+    assert dfa_cache_size() == size
+    assert compile_many(SPEC_CASES) == expected
+    # the restored DFA already knew these patterns
+    assert dfa_cache_size() == size
+
+
+def test_dfa_cache_of_another_grammar():
+    size = dfa_cache_size()
+
+    buffer = io.BytesIO()
+    pickle.dump("0" * 64, buffer)
+    buffer.seek(0)
+
+    assert not load_dfa_cache(buffer)
+    assert dfa_cache_size() == size
+
+
+def test_dfa_cache_unexpected_class():
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer)
+    pickler.dump(grammar_hash())
+    pickler.dump(os.system)
+    buffer.seek(0)
+
+    with pytest.raises(pickle.UnpicklingError):
+        load_dfa_cache(buffer)
+
+
+def test_dfa_cache_file(tmp_path):
+    cache = DFACache(str(tmp_path))
+
+    compile_many(SPEC_CASES)
+    # saved as the DFA grew since the process started
+    assert cache.save()
+    assert not cache.save()
+
+    restored = DFACache(str(tmp_path))
+    assert restored.load()
+    # unchanged since loaded
+    assert not restored.save()
+
+    (tmp_path / "stix_patterns.dfa").write_bytes(b"corrupted")
+    assert not DFACache(str(tmp_path)).load()
@@ -0,0 +1,71 @@
+"""
+Test cases for the scheduling of the feeds
+"""
+
+import pytest
+
+from sekoia_scheduler import JITTER, MAX_IDLE_BACKOFF, FeedScheduler
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr("sekoia_scheduler.random.uniform", lambda a, b: 0)
+
+
+def test_catch_up_right_away(tmp_path):
+    scheduler = FeedScheduler(str(tmp_path))
+
+    assert scheduler.reschedule("feed", 600, indicators=100, drained=False) == 0
+    assert scheduler.is_due("feed", 600)
+
+
+def test_idle_backoff(tmp_path, no_jitter):
+    scheduler = FeedScheduler(str(tmp_path))
+
+    delays = [scheduler.reschedule("feed", 100, indicators=0) for _ in range(5)]
+    assert delays == [100 * min(2**runs, MAX_IDLE_BACKOFF) for runs in range(5)]
+
+    # new indicators reset the backoff
+    assert scheduler.reschedule("feed", 100, indicators=1) == 100
+    assert scheduler.reschedule("feed", 100, indicators=0) == 100
+
+
+def test_jitter(tmp_path):
+    scheduler = FeedScheduler(str(tmp_path))
+
+    delays = {scheduler.reschedule("feed", 100, indicators=1) for _ in range(50)}
+
+    assert all(100 * (1 - JITTER) <= delay <= 100 * (1 + JITTER) for delay in delays)
+    assert len(delays) > 1
+
+
+def test_next_run_persisted(tmp_path, no_jitter, monkeypatch):
+    monkeypatch.setattr("sekoia_scheduler.time.time", lambda: 1000.0)
+    scheduler = FeedScheduler(str(tmp_path))
+    scheduler.reschedule("feed", 100, indicators=0)
+    scheduler.reschedule("feed", 100, indicators=0)
+
+    restarted = FeedScheduler(str(tmp_path))
+
+    assert restarted.next_run("feed", 100) == 1200.0
+    assert not restarted.is_due("feed", 100, now=1199.0)
+    assert restarted.is_due("feed", 100, now=1200.0)
+    # the idle runs are persisted with it
+    assert restarted.reschedule("feed", 100, indicators=0) == 400
+
+
+def test_next_run_bounded_by_a_reduced_interval(tmp_path, no_jitter, monkeypatch):
+    monkeypatch.setattr("sekoia_scheduler.time.time", lambda: 1000.0)
+    FeedScheduler(str(tmp_path)).reschedule("feed", 1000, indicators=1)
+
+    restarted = FeedScheduler(str(tmp_path))
+
+    assert restarted.next_run("feed", 10) == 1000.0 + 10 * MAX_IDLE_BACKOFF * (
+        1 + JITTER
+    )
+
+
+def test_unreadable_schedule(tmp_path):
+    (tmp_path / "feed.schedule").write_text("{not json")
+
+    assert FeedScheduler(str(tmp_path)).is_due("feed", 600)
@@ -0,0 +1,138 @@
+"""
+Test cases for the keep-alive request handler of the splunkd REST calls
+"""
+
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sekoia_splunkd import PooledHandler
+
+
+class SplunkdHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request with its method, path and body, keeping the
+    connection open unless the path asks otherwise:
+    /close announces that the connection is closed, /drop closes it silently
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self):
+        self.server.clients.append(self.client_address)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = "{} {} {}".format(
+            self.command, self.path, self.rfile.read(length).decode()
+        ).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if self.path == "/close":
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+        if self.path in ("/close", "/drop"):
+            self.close_connection = True
+
+    do_GET = do_POST = do_DELETE = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def splunkd():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SplunkdHandler)
+    server.clients = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def request(handler, server, path, method="GET", body=""):
+    url = "http://127.0.0.1:{}{}".format(server.server_port, path)
+    response = handler(url, {"method": method, "headers": [], "body": body})
+
+    assert response["status"] == 200
+    return response["body"].read().decode()
+
+
+def test_connection_reused(splunkd):
+    handler = PooledHandler()
+
+    responses = [
+        request(handler, splunkd, "/services/server/info"),
+        request(handler, splunkd, "/services/kvstore", "POST", "name=x"),
+        request(handler, splunkd, "/services/kvstore", "DELETE"),
+    ]
+    handler.close()
+
+    assert responses == [
+        "GET /services/server/info ",
+        "POST /services/kvstore name=x",
+        "DELETE /services/kvstore ",
+    ]
+    assert handler.stats() == {"requests": 3, "connections": 1}
+    assert len(set(splunkd.clients)) == 1
+
+
+def test_connection_closed_by_the_response(splunkd):
+    handler = PooledHandler()
+
+    request(handler, splunkd, "/close")
+    request(handler, splunkd, "/services/server/info")
+    handler.close()
+
+    # the connection closed by the response isn't kept idle
+    assert handler.stats() == {"requests": 2, "connections": 2}
+    assert len(set(splunkd.clients)) == 2
+
+
+def test_request_sent_again_after_a_stale_idle_connection(splunkd):
+    handler = PooledHandler()
+
+    request(handler, splunkd, "/drop")
+    # let the server close the idle connection
+    time.sleep(0.1)
+    response = request(handler, splunkd, "/services/server/info")
+    handler.close()
+
+    assert response == "GET /services/server/info "
+    assert handler.stats() == {"requests": 2, "connections": 2}
+    assert len(splunkd.clients) == 2
+
+
+def test_new_connection_failure_not_retried():
+    # nothing listens on the port once its socket is closed
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+    handler = PooledHandler()
+
+    with pytest.raises(ConnectionError):
+        handler(
+            "http://127.0.0.1:{}/services/server/info".format(port),
+            {"method": "GET", "headers": []},
+        )
+
+    assert handler.stats() == {"requests": 0, "connections": 1}
+
+
+def test_idle_connections_bounded(splunkd):
+    handler = PooledHandler(max_idle=1)
+    key = ("http", "127.0.0.1", splunkd.server_port)
+    connections = [handler._acquire(key)[0] for _ in range(2)]
+
+    for connection in connections:
+        handler._release(key, connection)
+
+    assert handler._idle[key] == connections[:1]
+    handler.close()
@@ -0,0 +1,243 @@
+"""
+Test cases for the storage of the indicators in the KV-Stores
+"""
+
+import asyncio
+import io
+
+import pytest
+from splunklib.binding import HTTPError
+
+from sekoia_digests import DigestIndex
+from sekoia_indicators import SEKOIAIndicators
+
+API_ROOT_URL = "https://api.sekoia.io"
+
+
+class EventWriter(object):
+    DEBUG, INFO, WARN, ERROR, FATAL = "DEBUG", "INFO", "WARN", "ERROR", "FATAL"
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, severity, message):
+        self.messages.append((severity, message))
+
+
+class FakeCollection(object):
+    """
+    KV-Store collection keeping its documents in a dict
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    def save_records(
+        self, records, max_documents, max_bytes, writer=None, on_saved=None
+    ):
+        for record in records:
+            self.documents[record.key] = record.indicator_id
+        if on_saved is not None:
+            on_saved(records)
+
+        return {"chunks": 1, "saved": len(records), "failed": 0, "errors": []}
+
+    def query(self, limit, fields):
+        return [{"_key": key} for key in list(self.documents)[:limit]]
+
+    def delete_keys(self, keys, writer=None):
+        deleted = [key for key in set(keys) if self.documents.pop(key, None)]
+
+        return {
+            "chunks": 1,
+            "deleted": len(deleted),
+            "missing": len(set(keys)) - len(deleted),
+            "failed": 0,
+            "errors": [],
+        }
+
+
+class Response(object):
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+        self.headers = []
+        self.body = io.BytesIO(b"")
+
+
+class UnavailableCollection(object):
+    """
+    KV-Store collection whose queries fail with an HTTP error
+    """
+
+    def __init__(self, status, reason):
+        self.response = Response(status, reason)
+
+    def query(self, **query):
+        raise HTTPError(self.response)
+
+
+class AsyncFakeCollection(object):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def save_records(self, *args, **kwargs):
+        return self.collection.save_records(*args, **kwargs)
+
+    async def delete_keys(self, *args, **kwargs):
+        return self.collection.delete_keys(*args, **kwargs)
+
+
+def indicator(indicator_id, value, revoked=False):
+    return {
+        "id": indicator_id,
+        "pattern": "[domain-name:value = '{}']".format(value),
+        "pattern_type": "stix",
+        "valid_until": "2099-01-01T00:00:00Z",
+        "revoked": revoked,
+    }
+
+
+@pytest.fixture
+def script(tmp_path):
+    script = SEKOIAIndicators()
+    script._digests = DigestIndex(str(tmp_path))
+    script._batch_save_limits = (1000, 1024 * 1024)
+
+    collections = {}
+    script.get_kvstore = lambda ioc_type: collections.setdefault(
+        ioc_type, FakeCollection()
+    )
+
+    async def get_async_kvstore(ioc_type):
+        return AsyncFakeCollection(script.get_kvstore(ioc_type))
+
+    script.get_async_kvstore = get_async_kvstore
+    yield script
+
+    script._digests.close()
+
+
+PAGES = [
+    [indicator("indicator--a", "evil.com")],
+    # another indicator of the key is revoked, the one owning it is unchanged
+    [
+        indicator("indicator--b", "evil.com", revoked=True),
+        indicator("indicator--a", "evil.com"),
+    ],
+]
+
+
+def test_unchanged_ioc_saved_again_after_revocation_of_its_key(script):
+    for page in PAGES:
+        script.store_indicators(page, EventWriter(), API_ROOT_URL)
+
+    assert script.get_kvstore("domain").documents == {"evil.com": "indicator--a"}
+
+
+def test_async_unchanged_ioc_saved_again_after_revocation_of_its_key(script):
+    async def store_pages():
+        for page in PAGES:
+            await script.async_store_indicators(page, EventWriter(), API_ROOT_URL)
+
+    asyncio.run(store_pages())
+
+    assert script.get_kvstore("domain").documents == {"evil.com": "indicator--a"}
+
+
+def test_unchanged_ioc_skipped(script):
+    script.store_indicators(PAGES[0], EventWriter(), API_ROOT_URL)
+    script.get_kvstore("domain").documents.clear()
+    script.store_indicators(PAGES[0], EventWriter(), API_ROOT_URL)
+
+    assert script.get_kvstore("domain").documents == {}
+    assert script._digests.stats()["unchanged"] == 1
+
+
+def test_streamed_page_stored_by_batches(script, monkeypatch):
+    monkeypatch.setattr("sekoia_indicators.STREAM_BATCH_SIZE", 100)
+    pulled = []
+    saved = []
+
+    def stream():
+        for i in range(250):
+            pulled.append(i)
+            yield indicator("indicator--{}".format(i), "d{}.com".format(i))
+
+    collection = script.get_kvstore("domain")
+    save_records = collection.save_records
+
+    def save_in_batch(records, *args, **kwargs):
+        # the stream is read no further than the batch being saved
+        saved.append((len(records), len(pulled)))
+        return save_records(records, *args, **kwargs)
+
+    collection.save_records = save_in_batch
+    script.store_indicators(stream(), EventWriter(), API_ROOT_URL)
+
+    assert saved == [(100, 100), (100, 200), (50, 250)]
+    assert len(collection.documents) == 250
+
+
+class Inputs(object):
+    def __init__(self, checkpoint_dir, **arguments):
+        self.inputs = {"sekoia_indicators://feed": arguments}
+        self.metadata = {"checkpoint_dir": checkpoint_dir}
+
+
+def test_pattern_stats_of_the_conversion_processes(script, tmp_path):
+    page = [
+        indicator("indicator--{}".format(i), "d{}.com".format(i % 40))
+        for i in range(80)
+    ]
+    script.get_conversion_executor(Inputs(str(tmp_path), conversion_workers="2"))
+    stats_before = script._patterns.stats()
+    ew = EventWriter()
+
+    try:
+        script.store_indicators(page, ew, API_ROOT_URL)
+        script.log_pattern_stats(ew, stats_before)
+    finally:
+        script._conversion_executor.shutdown(wait=True)
+
+    assert len(script.get_kvstore("domain").documents) == 40
+    # chunks of 50 and 30 indicators, with 40 and 30 distinct patterns
+    stats = script._patterns.stats()
+    assert stats["hits"] + stats["misses"] == 70
+    assert stats["fast_path"] == stats["misses"]
+    assert (
+        "INFO",
+        "Read {} patterns with the fast path and parsed 0 with "
+        "stix2patterns".format(stats["fast_path"]),
+    ) in ew.messages
+
+
+@pytest.mark.parametrize(
+    "status, reason, cleared", [(404, "Not Found", True), (503, "Unavailable", False)]
+)
+def test_digests_cleared_on_missing_collections_only(script, status, reason, cleared):
+    script.store_indicators(PAGES[0], EventWriter(), API_ROOT_URL)
+    documents = script.get_kvstore("domain").documents
+    documents.clear()
+    get_kvstore = script.get_kvstore
+    script.get_kvstore = lambda ioc_type: UnavailableCollection(status, reason)
+    ew = EventWriter()
+
+    script.check_digest_index(ew)
+
+    script.get_kvstore = get_kvstore
+    script.store_indicators(PAGES[0], EventWriter(), API_ROOT_URL)
+    # the IOC is saved again once its digest is forgotten
+    assert bool(documents) is cleared
+    assert any(severity == "ERROR" for severity, _ in ew.messages) is not cleared
+
+
+def test_digests_cleared_on_empty_collections(script):
+    script.store_indicators(PAGES[0], EventWriter(), API_ROOT_URL)
+    documents = script.get_kvstore("domain").documents
+    documents.clear()
+
+    script.check_digest_index(EventWriter())
+    script.store_indicators(PAGES[0], EventWriter(), API_ROOT_URL)
+
+    assert documents == {"evil.com": "indicator--a"}